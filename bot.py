@@ -1,14 +1,27 @@
 import os
 import re
+import json
 import asyncio
 import logging
-from datetime import date, datetime, timedelta
-from typing import List, Optional
+import sqlite3
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from functools import lru_cache
+from itertools import islice, product
+from pathlib import Path
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional
 
 import aiosqlite
-from aiohttp import web
-from aiogram import Bot, Dispatcher, F
+from aiohttp import FormData, web
+from aiogram import BaseMiddleware, Bot, Dispatcher, F
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
 from aiogram.filters import CommandStart
+from aiogram.filters.callback_data import CallbackData
+from aiogram.methods import GetUpdates
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import (
@@ -21,6 +34,12 @@ from aiogram.types import (
     CallbackQuery,
 )
 
+try:
+    # uvloop быстрее стандартного цикла событий; на Windows его нет — тогда asyncio
+    import uvloop
+except ImportError:
+    uvloop = None
+
 # -----------------------------------------
 # Настройки
 # -----------------------------------------
@@ -31,6 +50,15 @@ if not BOT_TOKEN:
 
 DB_PATH = "tennis.db"
 
+# Кол-во заранее открытых соединений с SQLite
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+# Сколько подготовленных запросов держит каждое соединение
+DB_STATEMENT_CACHE = 256
+# Страничный кэш SQLite на одно соединение, КиБ (умножается на DB_POOL_SIZE)
+DB_CACHE_SIZE_KIB = int(os.getenv("DB_CACHE_SIZE_KIB", 20000))
+# Как часто обновлять статистику планировщика через PRAGMA optimize (сек)
+DB_OPTIMIZE_INTERVAL = 3600
+
 # ID админа, куда будут прилетать обращения по /help
 ADMIN_CHAT_ID = 199804073
 
@@ -41,24 +69,89 @@ MAX_REALISTIC_AGE = 100
 
 # Ограничение на создание матчей: не в прошлом и не дальше чем на 3 месяца вперёд
 MAX_MATCH_DAYS_AHEAD = 90
+_MAX_AHEAD = timedelta(days=MAX_MATCH_DAYS_AHEAD)
+_ONE_DAY = timedelta(days=1)
 
 # Кол-во матчей на страницу в /games
 GAMES_PAGE_SIZE = 10
 
+# Как часто фоновая задача сбрасывает накопленные UPDATE одной транзакцией (сек)
+WRITE_BATCH_INTERVAL = 0.05
+
+# Сколько живёт кэш справочника кортов в памяти (сек)
+COURTS_CACHE_TTL = 300
+
+# Лимиты Telegram на исходящие запросы: ~30 в секунду на бота
+# и ~1 в секунду на чат (короткие всплески допустимы)
+TG_GLOBAL_RATE = 30
+TG_CHAT_RATE = 1
+TG_CHAT_BURST = 3
+
+# Таймаут одного запроса к Bot API (сек) и размер пула HTTP-соединений
+TG_REQUEST_TIMEOUT = 10
+TG_CONNECTION_LIMIT = 100
+
+# Сколько секунд профиль пользователя и его домашние корты живут в памяти
+USER_CACHE_TTL = 5
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-bot = Bot(BOT_TOKEN)
+# Статичные клавиатуры (id -> объект) и их уже сериализованный JSON
+_static_markups: Dict[int, Any] = {}
+_static_markup_json: Dict[int, str] = {}
+
+
+def register_static_markups(*markups):
+    """Клавиатуры, которые не меняются: их JSON для Bot API считаем один раз."""
+    for markup in markups:
+        _static_markups[id(markup)] = markup
+
+
+class MarkupCachingSession(AiohttpSession):
+    """
+    Сессия, которая не сериализует статичную клавиатуру заново на каждое
+    сообщение: JSON reply_markup считается при первой отправке и переиспользуется.
+    """
+
+    def build_form_data(self, bot: Bot, method) -> FormData:
+        markup = getattr(method, "reply_markup", None)
+        if markup is None or _static_markups.get(id(markup)) is not markup:
+            return super().build_form_data(bot, method)
+
+        markup_json = _static_markup_json.get(id(markup))
+        if markup_json is None:
+            markup_json = self.prepare_value(markup, bot=bot, files={})
+            _static_markup_json[id(markup)] = markup_json
+
+        form = FormData(quote_fields=False)
+        files: Dict[str, Any] = {}
+        for key, value in method.model_dump(warnings=False, exclude={"reply_markup"}).items():
+            value = self.prepare_value(value, bot=bot, files=files)
+            if not value:
+                continue
+            form.add_field(key, value)
+        form.add_field("reply_markup", markup_json)
+        for key, value in files.items():
+            form.add_field(key, value.read(bot), filename=value.filename or key)
+        return form
+
+
+bot = Bot(
+    BOT_TOKEN,
+    session=MarkupCachingSession(timeout=TG_REQUEST_TIMEOUT, limit=TG_CONNECTION_LIMIT),
+)
 dp = Dispatcher()
 
 MOSCOW_UTC_OFFSET = 3  # Москва: UTC+3 без перехода на летнее время
+MSK = timezone(timedelta(hours=MOSCOW_UTC_OFFSET))
 
 
 def get_moscow_now() -> datetime:
     """
     Текущее время в Москве (UTC+3), даже если сервер работает в UTC.
     """
-    return datetime.utcnow() + timedelta(hours=MOSCOW_UTC_OFFSET)
+    return datetime.now(MSK)
 
 
 def get_moscow_today() -> date:
@@ -138,6 +231,43 @@ class MyGames(StatesGroup):
 # Хелперы
 # -----------------------------------------
 
+try:
+    from itertools import batched
+except ImportError:  # Python < 3.12
+    def batched(iterable, n):
+        """batched('ABCDE', 2) -> ('A', 'B') ('C', 'D') ('E',)"""
+        it = iter(iterable)
+        while chunk := tuple(islice(it, n)):
+            yield chunk
+
+
+@dataclass(slots=True, frozen=True)
+class Court:
+    """Корт из справочника (кэшируется в памяти, см. get_active_courts)."""
+    id: int
+    short_name: str
+    address: Optional[str]
+    is_active: bool
+
+
+# Дата вида ДД.ММ.ГГГГ (день и месяц можно одной цифрой)
+_DATE_RE = re.compile(r"^(\d{1,2})\.(\d{1,2})\.(\d{4})$")
+# Строгий ручной ввод даты (рождения, матча): ровно ДД.ММ.ГГГГ
+_STRICT_DATE_RE = re.compile(r"^(\d{2})\.(\d{2})\.(\d{4})$")
+
+
+@lru_cache(maxsize=4096)
+def _parse_birth_date(birth_date_str: str) -> Optional[date]:
+    """'ДД.ММ.ГГГГ' -> date; разбор от текущего дня не зависит, поэтому кэшируется."""
+    m = _DATE_RE.match(birth_date_str)
+    if not m:
+        return None
+    try:
+        return date(int(m[3]), int(m[2]), int(m[1]))
+    except ValueError:
+        return None
+
+
 def calculate_age_from_str(birth_date_str: str) -> Optional[int]:
     """
     birth_date_str: 'ДД.ММ.ГГГГ'
@@ -145,48 +275,156 @@ def calculate_age_from_str(birth_date_str: str) -> Optional[int]:
     """
     if not birth_date_str:
         return None
+    dob = _parse_birth_date(birth_date_str)
+    return _age_on(dob, get_moscow_today()) if dob else None
+
+
+def calculate_age(day: int, month: int, year: int) -> Optional[int]:
+    """Возраст в полных годах по уже разобранной дате или None, если такой даты нет."""
     try:
-        day, month, year = map(int, birth_date_str.split("."))
         dob = date(year, month, day)
     except ValueError:
         return None
+    return _age_on(dob, get_moscow_today())
 
-    today = get_moscow_today()
-    age = (
+
+def _age_on(dob: date, today: date) -> int:
+    return (
         today.year
         - dob.year
         - ((today.month, today.day) < (dob.month, dob.day))
     )
-    return age
+
+
+async def patch_state(state: FSMContext, data: dict, **changes):
+    """
+    Дописывает изменения в уже прочитанный из FSM словарь и сохраняет его
+    одним set_data — без повторного чтения, которое делает update_data.
+    """
+    data.update(changes)
+    await state.set_data(data)
+
+
+async def advance_state(
+    state: FSMContext,
+    next_state: State,
+    data: Optional[dict] = None,
+    **changes,
+):
+    """
+    Сохраняет ответ шага и переводит FSM на следующий шаг.
+    Одна точка записи в хранилище: при переходе на Redis здесь
+    достаточно склеить оба вызова в один pipeline.
+    Если хэндлер уже прочитал данные FSM, передаёт их в data —
+    тогда они дописываются как в patch_state, без повторного чтения.
+    """
+    if data is None:
+        await state.update_data(**changes)
+    else:
+        await patch_state(state, data, **changes)
+    await state.set_state(next_state)
+
+
+# Префикс ответа (в нижнем регистре) -> значение пола в профиле
+GENDER_BY_PREFIX = {"муж": "Мужчина", "жен": "Женщина"}
+
+
+def parse_gender(text: str) -> Optional[str]:
+    """
+    'Мужчина' / 'муж' / 'Женщина' / ... -> 'Мужчина' или 'Женщина'; иначе None.
+    """
+    return GENDER_BY_PREFIX.get(text.strip()[:3].lower())
+
+
+# Кнопка «Пропустить»; принимаем и любой ответ, начинающийся с «пропус»
+_SKIP_PREFIX = "пропус"
+
+
+def is_skip_answer(text: str) -> bool:
+    """Смотрим только на первые символы — длинный текст целиком не копируем."""
+    return text.lstrip()[:len(_SKIP_PREFIX)].lower() == _SKIP_PREFIX
+
+
+@lru_cache(maxsize=64)
+def format_duration(minutes: int) -> str:
+    """90 -> '1 ч 30 мин', 60 -> '1 ч', 30 -> '30 мин'."""
+    hours, mins = divmod(minutes, 60)
+    if hours and mins:
+        return f"{hours} ч {mins} мин"
+    return f"{hours} ч" if hours else f"{mins} мин"
+
+
+def format_time_line(
+    match_time: str,
+    match_end_time: Optional[str],
+    duration_minutes: Optional[int] = None,
+) -> str:
+    """'Время: 18:00–19:30 (1 ч 30 мин)\\n'; конец и длительность — если известны."""
+    line = f"Время: {match_time}–{match_end_time}" if match_end_time else f"Время: {match_time}"
+    if duration_minutes:
+        line += f" ({format_duration(duration_minutes)})"
+    return line + "\n"
+
+
+def format_rating_limit(rating_min: Optional[float], rating_max: Optional[float]) -> str:
+    if rating_min is not None and rating_max is not None:
+        return f"{rating_min:.2f}-{rating_max:.2f}"
+    return "Без ограничений"
+
+
+def format_creator_line(g) -> str:
+    """Имя организатора с рейтингом — по строке списка с creator_name/creator_ntrp."""
+    creator_name = g["creator_name"] or "Игрок"
+    if g["creator_ntrp"] is not None:
+        return f"{creator_name} (NTRP {g['creator_ntrp']:.2f})"
+    return creator_name
+
+
+def format_game_card_body(g, occupied: int, total: int) -> str:
+    """Общая часть карточки матча во всех списках: от времени до комментария."""
+    return (
+        format_time_line(g["match_time"], g["match_end_time"], g["duration_minutes"])
+        + f"Корт: {g['court_short_name']} — <i>📍 {g['court_address'] or 'Адрес не указан'}</i>\n"
+        f"Игроки: {occupied} из {total}\n"
+        f"Ограничение по рейтингу: {format_rating_limit(g['rating_min'], g['rating_max'])}\n"
+        f"Бронь корта: {'забронирован' if g['is_court_booked'] else 'не забронирован'}\n"
+        f"Оплата: {PAYMENT_TEXT.get(g['payment_type'], 'не указано')}\n"
+        f"Комментарий: {g['comment'] or '—'}"
+    )
+
+
+# ЧЧ:ММ в 24-часовом формате; диапазоны часов и минут проверяет сама регулярка
+_TIME_RE = re.compile(r"^([01]?\d|2[0-3]):([0-5]\d)$")
 
 
 def parse_time(text: str) -> Optional[str]:
     """
     Ожидаем формат ЧЧ:ММ (24 часа). Возвращаем нормализованную строку 'HH:MM' или None.
     """
-    text = text.strip()
-    if not re.match(r"^\d{1,2}:\d{2}$", text):
-        return None
-    try:
-        hh, mm = map(int, text.split(":"))
-    except ValueError:
-        return None
-    if not (0 <= hh <= 23 and 0 <= mm <= 59):
-        return None
-    return f"{hh:02d}:{mm:02d}"
+    m = _TIME_RE.match(text.strip())
+    return f"{int(m[1]):02d}:{m[2]}" if m else None
+
+
+def hhmm_to_minutes(hhmm: str) -> int:
+    """'19:30' -> 1170. Строка уже нормализована (parse_time / кнопки), ширина фиксирована."""
+    return int(hhmm[:2]) * 60 + int(hhmm[3:5])
 
 
 def parse_ntrp_from_button(text: str) -> Optional[float]:
     if not text:
         return None
+    # Нажатая кнопка ntrp_kb — готовое значение из таблицы
+    value = _NTRP_BUTTON_TABLE.get(text)
+    if value is not None:
+        return value
+    return _parse_ntrp_label(text)
+
+
+def _parse_ntrp_label(text: str) -> Optional[float]:
     head = text.split("—", 1)[0].strip()
     head = head.replace(" ", "")
-    if "–" in head:
-        part = head.split("–", 1)[0]
-    elif "-" in head:
-        part = head.split("-", 1)[0]
-    else:
-        part = head
+    # Диапазон вида '6.0–7.0' или '6.0-7.0' — берём нижнюю границу
+    part = head.replace("–", "-").split("-", 1)[0]
     part = part.replace(",", ".")
     try:
         return float(part)
@@ -194,28 +432,59 @@ def parse_ntrp_from_button(text: str) -> Optional[float]:
         return None
 
 
+# Уровень NTRP числом от 1.00 до 7.00, до двух знаков после точки/запятой
+# (7 — только с нулями: 7.5 не «почти 7», а вне шкалы)
+_NTRP_RE = re.compile(r"^(?:[1-6](?:[.,]\d{1,2})?|7(?:[.,]0{1,2})?)$")
+
+
+def parse_ntrp_number(text: str) -> Optional[float]:
+    """
+    '3', '3.25', '3,5' -> float. Мусор отсекаем регуляркой,
+    чтобы не доходить до float() и исключения ValueError.
+    """
+    if not _NTRP_RE.match(text):
+        return None
+    return float(text.replace(",", ".") if "," in text else text)
+
+
 def parse_rating_value(text: str) -> Optional[float]:
     """
     Парсим значение рейтинга из кнопок вида '1.0', '1.5', '2.0', ... '7.0'
     """
     if not text:
         return None
-    t = text.replace(",", ".").strip()
-    try:
-        val = float(t)
-    except ValueError:
-        return None
-    if val < 1.0 or val > 7.0:
+    val = parse_ntrp_number(text.strip())
+    if val is None or val > 7.0:
         return None
     return round(val, 2)
 
 
 def normalize_custom_ntrp(value: float) -> float:
-    if value < 1.0:
-        value = 1.0
-    if value > 7.0:
-        value = 7.0
-    return round(value, 2)
+    return round(min(7.0, max(1.0, value)), 2)
+
+
+# Поправки к самооценке NTRP по ответам анкеты (точные тексты кнопок)
+_PE_MOD = {
+    "Нет, никогда": -0.25,
+    "Да, в этом году": 0.10,
+    "Да, более года назад": -0.05,
+    "Да, более пяти лет назад": -0.15,
+}
+_M6_MOD = {
+    "0–10 матчей": 0.0,
+    "10–100 матчей": 0.15,
+    "100 и более": 0.25,
+}
+_FIT_MOD = {
+    "Низкая": -0.15,
+    "Хорошая": 0.0,
+    "Отличная": 0.10,
+}
+_TOUR_MOD = {
+    "Не участвовал": 0.0,
+    "Tour": 0.15,
+    "Masters": 0.30,
+}
 
 
 def compute_final_ntrp(
@@ -225,43 +494,12 @@ def compute_final_ntrp(
     fitness: Optional[str],
     tournaments: Optional[str],
 ) -> float:
-    mod = 0.0
-    pe = (play_experience or "").lower()
-    m6 = (matches_6m or "").lower()
-    fit = (fitness or "").lower()
-    tour = (tournaments or "").lower()
-
-    # Как давно играл
-    if "никогда" in pe:
-        mod -= 0.25
-    elif "в этом году" in pe:
-        mod += 0.10
-    elif "более года" in pe:
-        mod -= 0.05
-    elif "более пяти" in pe:
-        mod -= 0.15
-
-    # Матчи за 6 месяцев
-    if "0–10" in m6 or "0-10" in m6:
-        mod += 0.0
-    elif "10–100" in m6 or "10-100" in m6:
-        mod += 0.15
-    elif "100" in m6:
-        mod += 0.25
-
-    # Физподготовка
-    if "низкая" in fit:
-        mod -= 0.15
-    elif "хорошая" in fit:
-        mod += 0.0
-    elif "отличная" in fit:
-        mod += 0.10
-
-    # Турниры
-    if "tour" in tour:
-        mod += 0.15
-    elif "masters" in tour:
-        mod += 0.30
+    mod = (
+        _PE_MOD.get(play_experience, 0.0)
+        + _M6_MOD.get(matches_6m, 0.0)
+        + _FIT_MOD.get(fitness, 0.0)
+        + _TOUR_MOD.get(tournaments, 0.0)
+    )
 
     final = base_ntrp + mod
     if final < 1.0:
@@ -324,6 +562,14 @@ ntrp_kb = ReplyKeyboardMarkup(
     resize_keyboard=True,
 )
 
+# Текст кнопки ntrp_kb -> уровень; строится один раз при загрузке модуля
+_NTRP_BUTTON_TABLE: dict[str, float] = {
+    btn.text: value
+    for row in ntrp_kb.keyboard
+    for btn in row
+    if (value := _parse_ntrp_label(btn.text)) is not None
+}
+
 play_experience_kb = ReplyKeyboardMarkup(
     keyboard=[
         [KeyboardButton(text="Нет, никогда")],
@@ -386,24 +632,19 @@ edit_menu_kb = ReplyKeyboardMarkup(
 HOME_DONE = "Готово ✅"
 HOME_SKIP = "Пропустить"
 
-def build_home_courts_kb(courts: List[aiosqlite.Row]) -> ReplyKeyboardMarkup:
-    """Клавиатура выбора домашних кортов с кнопкой «Готово» вверху."""
-    buttons: List[List[KeyboardButton]] = []
-    row: List[KeyboardButton] = []
+def build_home_courts_kb(courts: List[Court]) -> ReplyKeyboardMarkup:
+    """
+    Клавиатура выбора домашних кортов с кнопкой «Готово» вверху.
+    Пока список кортов не меняется, отдаём одну и ту же собранную разметку.
+    """
+    return _home_courts_kb(tuple(court.short_name for court in courts))
 
-    # Сначала строка с «Готово» / «Пропустить»
-    buttons.append(
-        [KeyboardButton(text=HOME_DONE), KeyboardButton(text=HOME_SKIP)]
-    )
 
-    # Затем сами корты по 2 в строке
-    for i, court in enumerate(courts, start=1):
-        row.append(KeyboardButton(text=court["short_name"]))
-        if i % 2 == 0:
-            buttons.append(row)
-            row = []
-    if row:
-        buttons.append(row)
+@lru_cache(maxsize=1)
+def _home_courts_kb(names: tuple[str, ...]) -> ReplyKeyboardMarkup:
+    # Сначала строка с «Готово» / «Пропустить», затем сами корты по 2 в строке
+    buttons = [[KeyboardButton(text=HOME_DONE), KeyboardButton(text=HOME_SKIP)]]
+    buttons += [[KeyboardButton(text=name) for name in pair] for pair in batched(names, 2)]
 
     return ReplyKeyboardMarkup(
         keyboard=buttons,
@@ -411,21 +652,16 @@ def build_home_courts_kb(courts: List[aiosqlite.Row]) -> ReplyKeyboardMarkup:
         one_time_keyboard=True,
     )
 
-def build_courts_single_kb(courts: List[aiosqlite.Row]) -> ReplyKeyboardMarkup:
+def build_courts_single_kb(courts: List[Court]) -> ReplyKeyboardMarkup:
     """
     Клавиатура для выбора одного корта (создание матча).
     """
-    buttons: List[List[KeyboardButton]] = []
-    row: List[KeyboardButton] = []
+    return _courts_single_kb(tuple(court.short_name for court in courts))
 
-    for i, court in enumerate(courts, start=1):
-        row.append(KeyboardButton(text=court["short_name"]))
-        if i % 2 == 0:
-            buttons.append(row)
-            row = []
-    if row:
-        buttons.append(row)
 
+@lru_cache(maxsize=1)
+def _courts_single_kb(names: tuple[str, ...]) -> ReplyKeyboardMarkup:
+    buttons = [[KeyboardButton(text=name) for name in pair] for pair in batched(names, 2)]
     buttons.append([KeyboardButton(text="Отмена")])
 
     return ReplyKeyboardMarkup(
@@ -452,54 +688,51 @@ def generate_time_keyboard(match_date_obj: date) -> InlineKeyboardMarkup:
     а логика выше покажет сообщение, что на эту дату матч создать нельзя.
     """
     now = get_moscow_now()
-    base = datetime(
-        year=match_date_obj.year,
-        month=match_date_obj.month,
-        day=match_date_obj.day,
-        hour=0,
-        minute=0,
-        second=0,
-        microsecond=0,
-    )
+    first_slot = 0
+    if match_date_obj == now.date():
+        # первый слот строго позже текущего времени
+        first_slot = (now.hour * 60 + now.minute) // 30 + 1
+    return _time_keyboard_from(first_slot)
 
-    buttons: list[InlineKeyboardButton] = []
 
-    # Собираем список всех слотов
-    for i in range(48):  # 24 часа * 2 слота по 30 минут
-        slot_dt = base + timedelta(minutes=30 * i)
-        # если это сегодня — не показываем прошедшие слоты
-        if match_date_obj == now.date() and slot_dt <= now:
-            continue
-        label = slot_dt.strftime("%H:%M")
-        buttons.append(
-            InlineKeyboardButton(
-                text=label,
-                callback_data=f"newgame_time:{label}",
-            )
-        )
+class NewGameTimeCb(CallbackData, prefix="nt"):
+    """Кнопка времени начала матча: 'nt:1930'."""
+    hhmm: str
 
-    # Раскладываем кнопки по рядам по 4 в строке
-    rows: list[list[InlineKeyboardButton]] = []
-    row: list[InlineKeyboardButton] = []
-    for btn in buttons:
-        row.append(btn)
-        if len(row) == 4:
-            rows.append(row)
-            row = []
-    if row:
-        rows.append(row)
 
+class DurationCb(CallbackData, prefix="d"):
+    """Кнопка продолжительности матча: 'd:90'."""
+    minutes: int
+
+
+# Все 48 получасовых слотов суток: подписи и callback_data строятся один раз
+_SLOT_LABELS = [f"{h:02d}:{m:02d}" for h in range(24) for m in (0, 30)]
+_SLOT_CB = [NewGameTimeCb(hhmm=label.replace(":", "")).pack() for label in _SLOT_LABELS]
+
+
+@lru_cache(maxsize=None)
+def _time_keyboard_from(first_slot: int) -> InlineKeyboardMarkup:
+    """
+    Клавиатура зависит только от первого видимого слота (0..48),
+    поэтому в пределах получаса все пользователи получают одну и ту же разметку.
+    """
+    buttons = [
+        InlineKeyboardButton(text=_SLOT_LABELS[i], callback_data=_SLOT_CB[i])
+        for i in range(first_slot, len(_SLOT_LABELS))
+    ]
+    # Раскладываем кнопки по рядам по 4 в строке
+    rows = [list(chunk) for chunk in batched(buttons, 4)]
     return InlineKeyboardMarkup(inline_keyboard=rows)
 
 # Клавиатура выбора продолжительности матча
 duration_kb = InlineKeyboardMarkup(
     inline_keyboard=[
-        [InlineKeyboardButton(text="30 мин", callback_data="duration:30")],
-        [InlineKeyboardButton(text="1 ч", callback_data="duration:60")],
-        [InlineKeyboardButton(text="1 ч 30 мин", callback_data="duration:90")],
-        [InlineKeyboardButton(text="2 ч", callback_data="duration:120")],
-        [InlineKeyboardButton(text="2 ч 30 мин", callback_data="duration:150")],
-        [InlineKeyboardButton(text="3 ч", callback_data="duration:180")],
+        [InlineKeyboardButton(text="30 мин", callback_data=DurationCb(minutes=30).pack())],
+        [InlineKeyboardButton(text="1 ч", callback_data=DurationCb(minutes=60).pack())],
+        [InlineKeyboardButton(text="1 ч 30 мин", callback_data=DurationCb(minutes=90).pack())],
+        [InlineKeyboardButton(text="2 ч", callback_data=DurationCb(minutes=120).pack())],
+        [InlineKeyboardButton(text="2 ч 30 мин", callback_data=DurationCb(minutes=150).pack())],
+        [InlineKeyboardButton(text="3 ч", callback_data=DurationCb(minutes=180).pack())],
     ],
 )
 
@@ -550,16 +783,9 @@ rating_limit_choice_kb = ReplyKeyboardMarkup(
 # Значения рейтинга для диапазона (1.0, 1.5, ..., 7.0)
 rating_values = [f"{x / 2:.1f}" for x in range(2, 15)]  # 1.0..7.0
 
+@lru_cache(maxsize=1)
 def build_rating_kb() -> ReplyKeyboardMarkup:
-    row = []
-    rows = []
-    for i, val in enumerate(rating_values, start=1):
-        row.append(KeyboardButton(text=val))
-        if i % 4 == 0:
-            rows.append(row)
-            row = []
-    if row:
-        rows.append(row)
+    rows = [[KeyboardButton(text=v) for v in chunk] for chunk in batched(rating_values, 4)]
     return ReplyKeyboardMarkup(
         keyboard=rows,
         resize_keyboard=True,
@@ -596,6 +822,36 @@ privacy_kb = ReplyKeyboardMarkup(
     one_time_keyboard=True,
 )
 
+# Комментарий к матчу можно пропустить
+skip_comment_kb = ReplyKeyboardMarkup(
+    keyboard=[[KeyboardButton(text="Пропустить")]],
+    resize_keyboard=True,
+)
+
+# Ответы на кнопки /newgame -> значения, которые сохраняем в матче
+CREATOR_MODE_BY_TEXT = {
+    "Создаю матч для себя": "self",
+    "Создаю матч для других": "others",
+}
+PAYMENT_TYPE_BY_TEXT = {
+    "Делим поровну между всеми игроками": "split",
+    "Плачу я (организатор)": "creator",
+    "Обсудим в чате": "discuss",
+}
+# Как показываем способ оплаты в карточке матча
+PAYMENT_TEXT = {
+    "split": "делим поровну между всеми игроками",
+    "creator": "организатор оплачивает корт",
+    "discuss": "обсудим оплату в чате",
+}
+GAME_TYPES = frozenset({"Тренировка", "Матч на рейтинг"})
+PLAYERS_COUNT_BY_TEXT = {"2 игрока": 2, "4 игрока": 4}
+COURT_BOOKED_BY_TEXT = {
+    "Корт уже забронирован": True,
+    "Корт пока не забронирован": False,
+}
+VISIBILITY_BY_TEXT = {"Публичный матч": "public", "Приватный матч": "private"}
+
 # ----- Клавиатуры для /games -----
 
 games_date_filter_kb = ReplyKeyboardMarkup(
@@ -619,6 +875,14 @@ games_time_choice_kb = ReplyKeyboardMarkup(
     resize_keyboard=True,
     one_time_keyboard=True,
 )
+# Кнопка фильтра по времени -> значение filter_time_from (ключ _TIME_RANGES / "night")
+TIME_FILTER_BY_TEXT = {
+    "Без фильтра по времени": None,
+    "Утро": "morning",
+    "День": "day",
+    "Вечер": "evening",
+    "Ночь": "night",
+}
 
 games_home_filter_kb = ReplyKeyboardMarkup(
     keyboard=[
@@ -652,6 +916,20 @@ my_games_main_kb = ReplyKeyboardMarkup(
     resize_keyboard=True,
     one_time_keyboard=True,
 )
+MY_GAMES_MENU_TEXT = "Раздел «Мои матчи».\nВыбери, что показать:"
+# Кнопка раздела -> фильтр по статусу (None — все матчи)
+MY_GAMES_STATUS_BY_TEXT = {
+    "Предстоящие матчи": "scheduled",
+    "Завершённые матчи": "finished",
+    "Отменённые матчи": "cancelled",
+    "Все мои матчи": None,
+}
+MY_GAMES_EMPTY_TEXT = {
+    "scheduled": "У тебя пока нет предстоящих матчей.",
+    "finished": "У тебя пока нет завершённых матчей.",
+    "cancelled": "У тебя пока нет отменённых матчей.",
+    None: "У тебя пока нет матчей.",
+}
 
 
 my_games_created_kb = ReplyKeyboardMarkup(
@@ -664,14 +942,113 @@ my_games_created_kb = ReplyKeyboardMarkup(
     one_time_keyboard=True,
 )
 
+# Убрать reply-клавиатуру: один экземпляр на весь бот
+remove_kb = ReplyKeyboardRemove()
+
+register_static_markups(
+    remove_kb, gender_kb, city_kb, ntrp_kb, play_experience_kb, matches_6m_kb, fitness_kb,
+    tournaments_kb, skip_about_kb, edit_menu_kb, date_choice_kb, duration_kb,
+    creator_mode_kb, payment_type_kb, game_type_kb, rating_limit_choice_kb,
+    players_count_kb, court_booking_kb, privacy_kb, skip_comment_kb, games_date_filter_kb,
+    games_time_choice_kb, games_home_filter_kb, games_browse_kb,
+    my_games_main_kb, my_games_created_kb,
+)
+
 # -----------------------------------------
 # База данных
 # -----------------------------------------
 
+# Применяются к каждому соединению пула сразу после открытия.
+# WAL + synchronous=NORMAL убирают fsync на каждый мелкий коммит.
+_CONN_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA mmap_size=268435456",
+    f"PRAGMA cache_size=-{DB_CACHE_SIZE_KIB}",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA foreign_keys=ON",
+)
+
+
+class DBPool:
+    """
+    Пул долгоживущих соединений aiosqlite.
+    Соединения открываются один раз при старте, а не на каждый запрос.
+    """
+
+    def __init__(self, path: str, size: int):
+        self._path = path
+        self._size = size
+        self._conns: List[aiosqlite.Connection] = []
+        self._queue: "asyncio.Queue[aiosqlite.Connection]" = asyncio.Queue()
+
+    async def open(self):
+        for _ in range(self._size):
+            conn = await aiosqlite.connect(self._path, cached_statements=DB_STATEMENT_CACHE)
+            conn.row_factory = aiosqlite.Row
+            for pragma in _CONN_PRAGMAS:
+                await conn.execute(pragma)
+            self._conns.append(conn)
+            self._queue.put_nowait(conn)
+
+    async def close(self):
+        for conn in self._conns:
+            await conn.close()
+        self._conns.clear()
+        self._queue = asyncio.Queue()
+
+    @asynccontextmanager
+    async def acquire(self):
+        conn = await self._queue.get()
+        try:
+            yield conn
+        finally:
+            # Незакоммиченное (например, после исключения) не должно
+            # достаться следующему владельцу соединения
+            if conn.in_transaction:
+                await conn.rollback()
+            self._queue.put_nowait(conn)
+
+
+pool = DBPool(DB_PATH, DB_POOL_SIZE)
+
+# Текущая версия схемы. Повышать при добавлении колонок в _ensure_*_columns
+# и при других миграциях старых БД (2 — user_home_courts стала WITHOUT ROWID).
+SCHEMA_VERSION = 2
+
+
+def db():
+    """Соединение из пула: `async with db() as conn: ...`"""
+    return pool.acquire()
+
+
+@asynccontextmanager
+async def tx(conn: aiosqlite.Connection):
+    """Явная транзакция: BEGIN IMMEDIATE ... COMMIT, при ошибке — ROLLBACK."""
+    await conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        await conn.rollback()
+        raise
+    await conn.commit()
+
+
 async def init_db():
-    async with aiosqlite.connect(DB_PATH) as db:
+    await pool.open()
+    async with db() as conn:
+        # Версия схемы: добор колонок в старых БД нужен только при её повышении
+        await conn.execute(
+            "CREATE TABLE IF NOT EXISTS schema_version (v INTEGER PRIMARY KEY);"
+        )
+        cursor = await conn.execute("SELECT MAX(v) FROM schema_version;")
+        row = await cursor.fetchone()
+        await cursor.close()
+        needs_migration = (row[0] or 0) < SCHEMA_VERSION
+
         # users
-        await db.execute(
+        await conn.execute(
             """
             CREATE TABLE IF NOT EXISTS users (
                 telegram_id INTEGER PRIMARY KEY,
@@ -692,10 +1069,11 @@ async def init_db():
             );
             """
         )
-        await _ensure_user_columns(db)
+        if needs_migration:
+            await _ensure_user_columns(conn)
 
         # courts
-        await db.execute(
+        await conn.execute(
             """
             CREATE TABLE IF NOT EXISTS courts (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -709,11 +1087,11 @@ async def init_db():
             """
         )
         # старые записи могли иметь NULL — считаем их активными
-        await db.execute("UPDATE courts SET is_active = 1 WHERE is_active IS NULL;")
-        await seed_courts_if_empty(db)
+        await conn.execute("UPDATE courts SET is_active = 1 WHERE is_active IS NULL;")
+        await seed_courts_if_empty(conn)
 
         # games
-        await db.execute(
+        await conn.execute(
             """
             CREATE TABLE IF NOT EXISTS games (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -739,22 +1117,17 @@ async def init_db():
             );
             """
         )
-        await _ensure_games_columns(db)
+        if needs_migration:
+            await _ensure_games_columns(conn)
 
-        # user_home_courts
-        await db.execute(
-            """
-            CREATE TABLE IF NOT EXISTS user_home_courts (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                telegram_id INTEGER NOT NULL,
-                court_id INTEGER NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );
-            """
-        )
+        # user_home_courts: первичный ключ (telegram_id, court_id) и есть сама
+        # таблица, поэтому корты пользователя читаются одним проходом по B-дереву
+        if needs_migration:
+            await _migrate_user_home_courts(conn)
+        await conn.execute(_USER_HOME_COURTS_DDL.format(table="user_home_courts"))
 
         # заявки на матчи
-        await db.execute(
+        await conn.execute(
             """
             CREATE TABLE IF NOT EXISTS game_applications (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -766,7 +1139,49 @@ async def init_db():
             """
         )
 
-        await db.commit()
+        await _ensure_indexes(conn)
+
+        if needs_migration:
+            await conn.execute(
+                "INSERT OR IGNORE INTO schema_version (v) VALUES (?);",
+                (SCHEMA_VERSION,),
+            )
+        await conn.commit()
+        # Статистика для планировщика, чтобы он выбирал новые индексы
+        await conn.execute("ANALYZE;")
+
+
+# Вторичные индексы под горячие запросы.
+# users.telegram_id — INTEGER PRIMARY KEY, отдельный индекс ему не нужен.
+_INDEXES = (
+    # Лента /games: публичные активные запланированные матчи по дате/времени
+    """
+    CREATE INDEX IF NOT EXISTS ix_games_upcoming
+    ON games(match_date, match_time)
+    WHERE is_active = 1 AND visibility = 'public' AND status = 'scheduled';
+    """,
+    # «Мои матчи»: по создателю, с фильтром по статусу и сортировкой по дате
+    """
+    CREATE INDEX IF NOT EXISTS ix_games_creator_date
+    ON games(creator_id, status, match_date, match_time);
+    """,
+    # Заявки на матч: по матчу + статус, покрывающий для COUNT и applicant_id;
+    # и по заявителю
+    """
+    CREATE INDEX IF NOT EXISTS ix_ga_game_status
+    ON game_applications(game_id, status, applicant_id);
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_ga_applicant ON game_applications(applicant_id);",
+)
+
+
+async def _ensure_indexes(db: aiosqlite.Connection):
+    for ddl in _INDEXES:
+        await db.execute(ddl)
+
+
+def _read_text(path: str) -> str:
+    return Path(path).read_text(encoding="utf-8")
 
 
 async def seed_courts_if_empty(db: aiosqlite.Connection):
@@ -774,6 +1189,7 @@ async def seed_courts_if_empty(db: aiosqlite.Connection):
     Если таблица courts пустая – читаем courts_seed_big.sql и заполняем её.
     """
     cursor = await db.execute("SELECT COUNT(*) FROM courts;")
+    cursor.row_factory = None
     row = await cursor.fetchone()
     await cursor.close()
     count = row[0] if row is not None else 0
@@ -783,15 +1199,19 @@ async def seed_courts_if_empty(db: aiosqlite.Connection):
 
     sql_path = os.path.join(os.path.dirname(__file__), "courts_seed_big.sql")
     try:
-        with open(sql_path, "r", encoding="utf-8") as f:
-            sql_script = f.read()
-        await db.executescript(sql_script)
+        # читаем файл в потоке, чтобы не блокировать event loop
+        sql_script = await asyncio.to_thread(_read_text, sql_path)
+        # весь сид — одна транзакция, сколько бы INSERT'ов ни было в файле
+        await db.executescript(f"BEGIN;\n{sql_script}\nCOMMIT;")
         logging.info("Courts seeded from courts_seed_big.sql")
     except FileNotFoundError:
         logging.warning(
             "courts_seed_big.sql not found, courts table will stay empty."
         )
     except Exception as e:
+        # не оставляем наполовину применённый сид в открытой транзакции
+        if db.in_transaction:
+            await db.rollback()
         logging.exception("Failed to seed courts from courts_seed_big.sql: %s", e)
 
 
@@ -846,71 +1266,315 @@ async def _ensure_games_columns(db: aiosqlite.Connection):
             await db.execute(f"ALTER TABLE games ADD COLUMN {col} {coltype};")
 
 
-async def get_active_courts() -> List[aiosqlite.Row]:
+_USER_HOME_COURTS_DDL = """
+CREATE TABLE IF NOT EXISTS {table} (
+    telegram_id INTEGER NOT NULL,
+    court_id INTEGER NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (telegram_id, court_id)
+) WITHOUT ROWID;
+"""
+
+
+async def _migrate_user_home_courts(db: aiosqlite.Connection):
+    """
+    Старая user_home_courts была rowid-таблицей с суррогатным id.
+    Переносим строки в WITHOUT ROWID-таблицу; дубли пар схлопываются.
+    """
+    cursor = await db.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'user_home_courts';"
+    )
+    row = await cursor.fetchone()
+    await cursor.close()
+    if row is None or "WITHOUT ROWID" in (row[0] or "").upper():
+        return
+
+    await db.execute("DROP TABLE IF EXISTS user_home_courts_new;")
+    await db.execute(_USER_HOME_COURTS_DDL.format(table="user_home_courts_new"))
+    await db.execute(
+        """
+        INSERT OR IGNORE INTO user_home_courts_new (telegram_id, court_id, created_at)
+        SELECT telegram_id, court_id, created_at
+        FROM user_home_courts
+        ORDER BY id;
+        """
+    )
+    await db.execute("DROP TABLE user_home_courts;")
+    await db.execute("ALTER TABLE user_home_courts_new RENAME TO user_home_courts;")
+
+
+# Кэш справочника кортов: все корты по id + активные, отсортированные по short_name
+_courts_by_id: dict[int, Court] = {}
+_active_courts_sorted: List[Court] = []
+_active_courts_by_name: dict[str, Court] = {}
+_courts_loaded_at: Optional[float] = None
+_courts_lock = asyncio.Lock()
+
+
+def invalidate_courts_cache():
+    """Сбросить кэш кортов — вызывать после любого изменения таблицы courts."""
+    global _courts_loaded_at
+    _courts_loaded_at = None
+
+
+async def refresh_courts():
+    """Перечитать справочник кортов прямо сейчас (старт бота, /reload_courts)."""
+    invalidate_courts_cache()
+    await _load_courts()
+
+
+async def _load_courts():
     """
-    Возвращаем все «активные» корты.
-    Важно: старые записи могли иметь is_active = NULL,
+    Перечитывает справочник кортов, если кэш пуст или устарел.
+    Старые записи могли иметь is_active = NULL,
     поэтому считаем COALESCE(is_active, 1) = 1.
     """
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        cursor = await db.execute(
-            """
-            SELECT id, short_name, address
-            FROM courts
-            WHERE COALESCE(is_active, 1) = 1
-            ORDER BY short_name;
-            """
-        )
-        rows = await cursor.fetchall()
-        await cursor.close()
-        return list(rows)
+    global _courts_by_id, _active_courts_sorted, _active_courts_by_name, _courts_loaded_at
+    if _courts_loaded_at is not None and time.monotonic() - _courts_loaded_at < COURTS_CACHE_TTL:
+        return
+    async with _courts_lock:
+        # пока ждали блокировку, кэш мог обновить другой запрос
+        if _courts_loaded_at is not None and time.monotonic() - _courts_loaded_at < COURTS_CACHE_TTL:
+            return
+        async with db() as conn:
+            cursor = await conn.execute(
+                """
+                SELECT id, short_name, address, COALESCE(is_active, 1) = 1
+                FROM courts
+                ORDER BY short_name;
+                """
+            )
+            cursor.row_factory = None
+            rows = await cursor.fetchall()
+            await cursor.close()
+        courts = [Court(r[0], r[1], r[2], bool(r[3])) for r in rows]
+        _courts_by_id = {c.id: c for c in courts}
+        _active_courts_sorted = [c for c in courts if c.is_active]
+        _active_courts_by_name = {c.short_name: c for c in _active_courts_sorted}
+        _courts_loaded_at = time.monotonic()
+
+
+async def get_active_courts() -> List[Court]:
+    """Возвращаем все «активные» корты (из кэша)."""
+    await _load_courts()
+    return _active_courts_sorted
 
 
-async def get_court_by_id(court_id: int) -> Optional[aiosqlite.Row]:
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        cursor = await db.execute(
-            "SELECT * FROM courts WHERE id = ?;",
-            (court_id,),
+async def get_court_by_id(court_id: int) -> Optional[Court]:
+    await _load_courts()
+    return _courts_by_id.get(court_id)
+
+
+async def get_active_court_by_name(short_name: str) -> Optional[Court]:
+    """Активный корт по тексту кнопки (short_name)."""
+    await _load_courts()
+    return _active_courts_by_name.get(short_name)
+
+
+async def get_court_names(court_ids: List[int]) -> List[str]:
+    """Названия кортов в порядке id; неизвестный id показываем как есть."""
+    await _load_courts()
+    return [
+        court.short_name if (court := _courts_by_id.get(cid)) else str(cid)
+        for cid in court_ids
+    ]
+
+
+# Больше строк в одном INSERT ... VALUES не собираем: у SQLite есть лимит
+# на число параметров в запросе (999 в старых сборках)
+_MULTI_INSERT_MAX_ROWS = 400
+
+
+async def _replace_home_courts(conn: aiosqlite.Connection, telegram_id: int, court_ids: List[int]):
+    await conn.execute(
+        "DELETE FROM user_home_courts WHERE telegram_id = ?;",
+        (telegram_id,),
+    )
+    if not court_ids:
+        return
+    if len(court_ids) <= _MULTI_INSERT_MAX_ROWS:
+        # одна вставка с несколькими VALUES — один prepared statement
+        placeholders = ", ".join(["(?, ?)"] * len(court_ids))
+        params = [p for cid in court_ids for p in (telegram_id, cid)]
+        await conn.execute(
+            f"INSERT OR IGNORE INTO user_home_courts (telegram_id, court_id) VALUES {placeholders};",
+            params,
+        )
+    else:
+        await conn.executemany(
+            "INSERT OR IGNORE INTO user_home_courts (telegram_id, court_id) VALUES (?, ?);",
+            [(telegram_id, cid) for cid in court_ids],
         )
-        row = await cursor.fetchone()
-        await cursor.close()
-        return row
 
 
 async def save_user_home_courts(telegram_id: int, court_ids: List[int]):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "DELETE FROM user_home_courts WHERE telegram_id = ?;",
-            (telegram_id,),
-        )
-        if court_ids:
-            await db.executemany(
-                "INSERT INTO user_home_courts (telegram_id, court_id) VALUES (?, ?);",
-                [(telegram_id, cid) for cid in court_ids],
-            )
-        await db.commit()
+    async with db() as conn, tx(conn):
+        await _replace_home_courts(conn, telegram_id, court_ids)
+    invalidate_user_cache(telegram_id)
+
+
+
 
+# Последний записанный в БД username по telegram_id: username меняют редко,
+# поэтому повторный UPDATE на каждую команду обычно не нужен
+_USERNAME_CACHE_MAX = 10_000
+_known_usernames: Dict[int, str] = {}
 
 
+def _remember_username(tg_id: int, username: str):
+    if len(_known_usernames) >= _USERNAME_CACHE_MAX:
+        _known_usernames.clear()
+    _known_usernames[tg_id] = username
+
 
 async def update_username_only(tg_id: int, username: Optional[str]):
-    """Обновляет username в базе для пользователя, если он есть."""
-    if username is None:
+    """Обновляет username в базе для пользователя, если он есть и изменился."""
+    if username is None or _known_usernames.get(tg_id) == username:
         return
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
+    async with db() as conn:
+        await conn.execute(
             "UPDATE users SET username = ? WHERE telegram_id = ?;",
             (username, tg_id),
         )
-        await db.commit()
+        await conn.commit()
+    _remember_username(tg_id, username)
+    invalidate_user_cache(tg_id)
+
+
+async def upsert_username_and_get(tg_id: int, username: Optional[str]):
+    """
+    Обновляет username и сразу возвращает профиль — одним запросом (RETURNING).
+    Если username не менялся, только читаем профиль (обычно из кэша).
+    Если анкеты ещё нет, вернёт None, как и get_user.
+    """
+    if username is None or _known_usernames.get(tg_id) == username:
+        return await get_user(tg_id)
+    if not _HAS_RETURNING:
+        await update_username_only(tg_id, username)
+        return await get_user(tg_id)
+    async with db() as conn:
+        cursor = await conn.execute(
+            "UPDATE users SET username = ? WHERE telegram_id = ? RETURNING *;",
+            (username, tg_id),
+        )
+        row = await cursor.fetchone()
+        await cursor.close()
+        await conn.commit()
+    if row is not None:
+        _remember_username(tg_id, username)
+    invalidate_user_cache(tg_id)
+    _user_reads.prime(tg_id, row)
+    return row
+
+
+class SingleFlight:
+    """
+    Одновременные чтения одного ключа ждут один общий запрос к БД,
+    а результат ещё ttl секунд отдаётся из памяти.
+    После записи ключ нужно сбросить через invalidate().
+    """
+
+    def __init__(self, ttl: float):
+        self._ttl = ttl
+        self._inflight: Dict[Any, asyncio.Future] = {}
+        self._cache: Dict[Any, tuple[float, Any]] = {}
+        # Растёт при каждом invalidate(): по нему видно, была ли запись,
+        # пока шло чтение в обход get() (см. prime_many)
+        self.epoch = 0
+
+    async def get(self, key, load: Callable[[], Awaitable[Any]]):
+        hit = self._cache.get(key)
+        if hit is not None and time.monotonic() - hit[0] < self._ttl:
+            return hit[1]
+
+        fut = self._inflight.get(key)
+        if fut is not None:
+            return await asyncio.shield(fut)
+
+        fut = asyncio.get_running_loop().create_future()
+        self._inflight[key] = fut
+        try:
+            value = await load()
+        except BaseException as e:
+            fut.set_exception(e)
+            fut.exception()  # помечаем как полученное, если никто не ждал
+            raise
+        else:
+            fut.set_result(value)
+            # если ключ сбросили, пока шёл запрос, — результат уже мог устареть
+            if self._inflight.get(key) is fut:
+                self._put(key, value)
+            return value
+        finally:
+            if self._inflight.get(key) is fut:
+                del self._inflight[key]
+
+    def _put(self, key, value):
+        now = time.monotonic()
+        if len(self._cache) >= 1024:
+            self._cache = {
+                k: v for k, v in self._cache.items() if now - v[0] < self._ttl
+            }
+        self._cache[key] = (now, value)
+
+    def prime(self, key, value):
+        """Положить в кэш значение, уже полученное вместе с записью."""
+        self._put(key, value)
+
+    def prime_many(self, items, since: int):
+        """
+        Положить в кэш результаты чтения, начатого при epoch == since.
+        Если за это время хоть один ключ сбросили, строки могли устареть —
+        тогда ничего не кладём (следующий get() просто сходит в БД).
+        """
+        if self.epoch != since:
+            return
+        for key, value in items:
+            self._put(key, value)
+
+    def invalidate(self, key):
+        self.epoch += 1
+        self._cache.pop(key, None)
+        self._inflight.pop(key, None)
+
+
+_user_reads = SingleFlight(USER_CACHE_TTL)
+_home_courts_reads = SingleFlight(USER_CACHE_TTL)
+
+
+def invalidate_user_cache(tg_id: int):
+    """Сбросить закэшированный профиль и домашние корты после записи."""
+    _user_reads.invalidate(tg_id)
+    _home_courts_reads.invalidate(tg_id)
 
 
 async def get_user(tg_id: int):
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        cursor = await db.execute(
+    return await _user_reads.get(tg_id, lambda: _fetch_user(tg_id))
+
+
+async def get_users_bulk(tg_ids: List[int]) -> Dict[int, aiosqlite.Row]:
+    """
+    Профили сразу нескольких пользователей одним запросом: telegram_id -> строка.
+    Кого нет в базе — просто нет в словаре.
+    """
+    if not tg_ids:
+        return {}
+    epoch = _user_reads.epoch
+    async with db() as conn:
+        cursor = await conn.execute(
+            "SELECT * FROM users WHERE telegram_id IN (SELECT value FROM json_each(?));",
+            (json.dumps(list(tg_ids)),),
+        )
+        rows = await cursor.fetchall()
+        await cursor.close()
+    users = {r["telegram_id"]: r for r in rows}
+    _user_reads.prime_many(users.items(), since=epoch)
+    return users
+
+
+async def _fetch_user(tg_id: int):
+    async with db() as conn:
+        cursor = await conn.execute(
             "SELECT * FROM users WHERE telegram_id = ?",
             (tg_id,),
         )
@@ -919,87 +1583,73 @@ async def get_user(tg_id: int):
         return row
 
 
-async def upsert_user(
-    tg_id: int,
-    username: Optional[str],
-    name: Optional[str],
-    gender: Optional[str],
-    city: Optional[str],
-    ntrp: Optional[float],
-    ntrp_self: Optional[float],
-    play_experience: Optional[str],
-    matches_6m: Optional[str],
-    fitness: Optional[str],
-    tournaments: Optional[str],
-    birth_date: Optional[str],
-    about: Optional[str],
-    photo_file_id: Optional[str],
-):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            """
-            INSERT INTO users (
-                telegram_id, username, name, gender, city,
-                ntrp, ntrp_self,
-                play_experience, matches_6m, fitness, tournaments, birth_date,
-                about, photo_file_id
-            )
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ON CONFLICT(telegram_id) DO UPDATE SET
-                username        = excluded.username,
-                name            = excluded.name,
-                gender          = excluded.gender,
-                city            = excluded.city,
-                ntrp            = excluded.ntrp,
-                ntrp_self       = excluded.ntrp_self,
-                play_experience = excluded.play_experience,
-                matches_6m      = excluded.matches_6m,
-                fitness         = excluded.fitness,
-                tournaments     = excluded.tournaments,
-                birth_date      = excluded.birth_date,
-                about           = excluded.about,
-                photo_file_id   = excluded.photo_file_id;
-            """,
-            (
-                tg_id,
-                username,
-                name,
-                gender,
-                city,
-                ntrp,
-                ntrp_self,
-                play_experience,
-                matches_6m,
-                fitness,
-                tournaments,
-                birth_date,
-                about,
-                photo_file_id,
-            ),
-        )
-        await db.commit()
+# Один и тот же текст запроса -> sqlite3 берёт готовый prepared statement из кэша соединения
+_UPSERT_USER_SQL = """
+INSERT INTO users (
+    telegram_id, username, name, gender, city,
+    ntrp, ntrp_self,
+    play_experience, matches_6m, fitness, tournaments, birth_date,
+    about, photo_file_id
+)
+VALUES (
+    :tg_id, :username, :name, :gender, :city,
+    :ntrp, :ntrp_self,
+    :play_experience, :matches_6m, :fitness, :tournaments, :birth_date,
+    :about, :photo_file_id
+)
+ON CONFLICT(telegram_id) DO UPDATE SET
+    username        = excluded.username,
+    name            = excluded.name,
+    gender          = excluded.gender,
+    city            = excluded.city,
+    ntrp            = excluded.ntrp,
+    ntrp_self       = excluded.ntrp_self,
+    play_experience = excluded.play_experience,
+    matches_6m      = excluded.matches_6m,
+    fitness         = excluded.fitness,
+    tournaments     = excluded.tournaments,
+    birth_date      = excluded.birth_date,
+    about           = excluded.about,
+    photo_file_id   = excluded.photo_file_id;
+"""
+
+
+async def _upsert_user(conn: aiosqlite.Connection, row: dict):
+    await conn.execute(_UPSERT_USER_SQL, row)
+
+
+async def save_onboarding(user_row: dict, court_ids: List[int]):
+    """
+    Финал онбординга: профиль и домашние корты пишутся
+    в одной транзакции (один коммит вместо двух).
+    """
+    async with db() as conn, tx(conn):
+        await _upsert_user(conn, user_row)
+        await _replace_home_courts(conn, user_row["tg_id"], court_ids)
+    invalidate_user_cache(user_row["tg_id"])
 
 
-async def get_user_home_courts(tg_id: int) -> List[aiosqlite.Row]:
+async def get_user_home_courts(tg_id: int) -> List[Court]:
     """
-    Возвращает список домашних кортов пользователя:
-    rows с полями short_name, address
+    Возвращает домашние корты пользователя (Court из кэша справочника),
+    отсортированные по short_name. Из БД читаем только id кортов.
     """
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        cursor = await db.execute(
-            """
-            SELECT c.short_name, c.address
-            FROM user_home_courts uh
-            JOIN courts c ON c.id = uh.court_id
-            WHERE uh.telegram_id = ?
-            ORDER BY c.short_name;
-            """,
+    return await _home_courts_reads.get(tg_id, lambda: _fetch_user_home_courts(tg_id))
+
+
+async def _fetch_user_home_courts(tg_id: int) -> List[Court]:
+    async with db() as conn:
+        cursor = await conn.execute(
+            "SELECT court_id FROM user_home_courts WHERE telegram_id = ?;",
             (tg_id,),
         )
+        cursor.row_factory = None
         rows = await cursor.fetchall()
         await cursor.close()
-        return list(rows)
+    await _load_courts()
+    courts = [_courts_by_id[r[0]] for r in rows if r[0] in _courts_by_id]
+    courts.sort(key=lambda c: c.short_name)
+    return courts
 
 
 async def delete_user(tg_id: int):
@@ -1007,16 +1657,106 @@ async def delete_user(tg_id: int):
     Удаляет пользователя и его домашние корты.
     Нужен для /reset, чтобы можно было пройти онбординг заново.
     """
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
+    async with db() as conn:
+        await conn.execute(
             "DELETE FROM user_home_courts WHERE telegram_id = ?;",
             (tg_id,),
         )
-        await db.execute(
+        await conn.execute(
             "DELETE FROM users WHERE telegram_id = ?;",
             (tg_id,),
         )
-        await db.commit()
+        await conn.commit()
+    _known_usernames.pop(tg_id, None)
+    invalidate_user_cache(tg_id)
+
+
+# Очередь отложенной записи: одиночные UPDATE из редактора профиля
+# копятся здесь и коммитятся пачкой, а не по одному fsync на каждое сообщение.
+_write_queue: "asyncio.Queue[tuple[str, tuple, asyncio.Future]]" = asyncio.Queue()
+
+
+async def enqueue_write(sql: str, params: tuple):
+    """
+    Ставит запрос в очередь отложенной записи и ждёт,
+    пока пачка с ним будет закоммичена.
+    """
+    fut = asyncio.get_running_loop().create_future()
+    await _write_queue.put((sql, params, fut))
+    await fut
+
+
+async def write_behind_worker():
+    """
+    Фоновая задача: раз в WRITE_BATCH_INTERVAL забирает всё, что накопилось
+    в очереди, и выполняет одной транзакцией.
+    """
+    while True:
+        batch = [await _write_queue.get()]
+        await asyncio.sleep(WRITE_BATCH_INTERVAL)
+        while not _write_queue.empty():
+            batch.append(_write_queue.get_nowait())
+
+        done = []
+        try:
+            async with db() as conn:
+                for sql, params, fut in batch:
+                    try:
+                        await conn.execute(sql, params)
+                    except Exception as e:
+                        # Ошибка одного запроса не должна ронять всю пачку
+                        if not fut.done():
+                            fut.set_exception(e)
+                    else:
+                        done.append(fut)
+                await conn.commit()
+        except Exception as e:
+            logger.exception("Failed to flush write-behind batch: %s", e)
+            for _, _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            continue
+
+        for fut in done:
+            if not fut.done():
+                fut.set_result(None)
+
+
+# Поля профиля, которые можно менять из редактора /edit, и готовый SQL для каждого.
+# Имя колонки никогда не подставляется из пользовательского ввода.
+_USER_FIELD_UPDATES: Dict[str, str] = {
+    field: f"UPDATE users SET {field} = ? WHERE telegram_id = ?;"
+    for field in ("name", "gender", "city", "birth_date", "about", "photo_file_id")
+}
+
+
+async def update_user_field(tg_id: int, field: str, value: Any):
+    """Обновляет одно поле профиля через очередь отложенной записи."""
+    sql = _USER_FIELD_UPDATES.get(field)
+    if sql is None:
+        raise ValueError(f"Unknown user field: {field}")
+    await enqueue_write(sql, (value, tg_id))
+    invalidate_user_cache(tg_id)
+
+
+async def db_optimize_worker():
+    """
+    Фоновая задача: раз в DB_OPTIMIZE_INTERVAL просит SQLite обновить
+    статистику там, где она устарела, чтобы лента и «мои матчи»
+    не съезжали с индексов на полный скан по мере роста таблиц.
+    """
+    while True:
+        await asyncio.sleep(DB_OPTIMIZE_INTERVAL)
+        try:
+            async with db() as conn:
+                await conn.execute("PRAGMA optimize;")
+        except Exception as e:
+            logger.exception("PRAGMA optimize failed: %s", e)
+
+
+# INSERT ... RETURNING появился в SQLite 3.35; на старых сборках берём lastrowid
+_HAS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+_INSERT_GAME_TAIL = " RETURNING id;" if _HAS_RETURNING else ";"
 
 
 async def create_game(
@@ -1036,8 +1776,8 @@ async def create_game(
     creator_mode: str = "self",
     payment_type: Optional[str] = None,
 ) -> int:
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
+    async with db() as conn:
+        cursor = await conn.execute(
             """
             INSERT INTO games (
                 creator_id, court_id, match_date, match_time, match_end_time, duration_minutes,
@@ -1045,8 +1785,8 @@ async def create_game(
                 players_count, comment,
                 is_court_booked, visibility, creator_mode, payment_type, is_active, status
             )
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 1, 'scheduled');
-            """,
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 1, 'scheduled')
+            """ + _INSERT_GAME_TAIL,
             (
                 creator_id,
                 court_id,
@@ -1065,17 +1805,93 @@ async def create_game(
                 payment_type,
             ),
         )
-        cursor = await db.execute("SELECT last_insert_rowid();")
-        row = await cursor.fetchone()
+        if _HAS_RETURNING:
+            row = await cursor.fetchone()
+            game_id = row[0]
+        else:
+            game_id = cursor.lastrowid
         await cursor.close()
-        await db.commit()
-        return row[0]
+        await conn.commit()
+        return game_id
+
+
+# Заявка создаётся, только если матч активный и публичный, он не свой
+# и заявки от этого игрока ещё нет — проверка и вставка одним оператором
+_APPLY_SQL = """
+INSERT INTO game_applications (game_id, applicant_id)
+SELECT g.id, :applicant_id
+FROM games g
+WHERE g.id = :game_id
+  AND g.is_active = 1
+  AND g.visibility = 'public'
+  AND g.creator_id <> :applicant_id
+  AND NOT EXISTS (
+      SELECT 1 FROM game_applications
+      WHERE game_id = g.id AND applicant_id = :applicant_id
+  )
+"""
+
+APPLY_OK = "ok"
+APPLY_UNAVAILABLE = "unavailable"
+APPLY_OWN_GAME = "own"
+APPLY_EXISTS = "exists"
+
+
+async def apply_to_game(game_id: int, applicant_id: int) -> tuple[str, Optional[int], Optional[int]]:
+    """
+    Подаёт заявку на матч. Возвращает (итог, id заявки, id создателя матча);
+    итог — одна из констант APPLY_*. При успехе это один INSERT ... RETURNING,
+    выяснять причину отказа ходим в БД ещё раз только при неудаче.
+    """
+    params = {"game_id": game_id, "applicant_id": applicant_id}
+    async with db() as conn:
+        async with tx(conn):
+            if _HAS_RETURNING:
+                cursor = await conn.execute(
+                    _APPLY_SQL + " RETURNING id, (SELECT creator_id FROM games WHERE id = game_id);",
+                    params,
+                )
+                cursor.row_factory = None
+                row = await cursor.fetchone()
+                await cursor.close()
+            else:
+                cursor = await conn.execute(_APPLY_SQL + ";", params)
+                row = (cursor.lastrowid, None) if cursor.rowcount == 1 else None
+                await cursor.close()
+
+        if row is not None and row[1] is not None:
+            return APPLY_OK, row[0], row[1]
+
+        cursor = await conn.execute(
+            """
+            SELECT creator_id,
+                   is_active = 1 AND visibility = 'public',
+                   EXISTS (
+                       SELECT 1 FROM game_applications
+                       WHERE game_id = games.id AND applicant_id = ?
+                   )
+            FROM games
+            WHERE id = ?;
+            """,
+            (applicant_id, game_id),
+        )
+        cursor.row_factory = None
+        game = await cursor.fetchone()
+        await cursor.close()
+
+    if row is not None:
+        # старый SQLite без RETURNING: заявка создана, создателя дочитали отдельно
+        return APPLY_OK, row[0], game[0]
+    if game is None or not game[1]:
+        return APPLY_UNAVAILABLE, None, None
+    if game[0] == applicant_id:
+        return APPLY_OWN_GAME, None, game[0]
+    return APPLY_EXISTS, None, game[0]
 
 
 async def get_game_by_id(game_id: int) -> Optional[aiosqlite.Row]:
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        cursor = await db.execute(
+    async with db() as conn:
+        cursor = await conn.execute(
             """
             SELECT g.*, c.short_name AS court_short_name, c.address AS court_address
             FROM games g
@@ -1089,47 +1905,53 @@ async def get_game_by_id(game_id: int) -> Optional[aiosqlite.Row]:
         return row
 
 
+# Число принятых заявок на матч g — для списков матчей, чтобы не ходить
+# за занятостью отдельным запросом на каждую карточку (ix_ga_game_status покрывает)
+_ACCEPTED_COUNT_COL = """
+       (SELECT COUNT(*)
+        FROM game_applications
+        WHERE game_id = g.id AND status = 'accepted') AS accepted_count"""
+
+
+def occupied_seats(creator_mode: Optional[str], accepted: int) -> int:
+    """Организатор занимает место, только если играет сам (creator_mode = 'self')."""
+    return accepted + (1 if creator_mode == "self" else 0)
+
+
+def game_occupancy(g) -> tuple[int, int]:
+    """(занятых мест, всего мест) по строке списка матчей с accepted_count."""
+    return occupied_seats(g["creator_mode"], g["accepted_count"]), g["players_count"]
+
+
 async def get_game_occupancy(game_id: int) -> tuple[int, int]:
     """
     Возвращает кортеж (занятых мест, всего мест) для матча.
     Организатор матча учитывается как занявший одно место, если creator_mode = 'self'.
     """
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-
-        # Общая информация по матчу
-        cursor = await db.execute(
-            "SELECT players_count, creator_mode FROM games WHERE id = ?;",
-            (game_id,),
-        )
-        row = await cursor.fetchone()
-        await cursor.close()
-
-        if not row:
-            return 0, 0
-
-        players_count = row["players_count"]
-        creator_mode = row["creator_mode"]
-
-        # Сколько заявок уже принято
-        cursor = await db.execute(
+    async with db() as conn:
+        # Матч и число принятых заявок — одним запросом
+        cursor = await conn.execute(
             """
-            SELECT COUNT(*)
-            FROM game_applications
-            WHERE game_id = ?
-              AND status = 'accepted';
+            SELECT g.players_count,
+                   g.creator_mode,
+                   (SELECT COUNT(*)
+                    FROM game_applications
+                    WHERE game_id = g.id AND status = 'accepted') AS accepted
+            FROM games g
+            WHERE g.id = ?;
             """,
             (game_id,),
         )
-        accepted_row = await cursor.fetchone()
+        # три скаляра — хватит обычного кортежа, aiosqlite.Row не строим
+        cursor.row_factory = None
+        row = await cursor.fetchone()
         await cursor.close()
 
-        accepted_count = accepted_row[0] if accepted_row else 0
+    if not row:
+        return 0, 0
 
-        base = 1 if creator_mode == "self" else 0
-        occupied = base + accepted_count
-
-        return occupied, players_count
+    players_count, creator_mode, accepted = row
+    return occupied_seats(creator_mode, accepted), players_count
 
 
 async def get_game_participant_ids(game_id: int, include_creator: bool = True) -> List[int]:
@@ -1137,44 +1959,86 @@ async def get_game_participant_ids(game_id: int, include_creator: bool = True) -
     Возвращает список Telegram ID участников матча.
     Участники = все принятые заявки + организатор (если он играет сам).
     """
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-
-        cursor = await db.execute(
-            "SELECT creator_id, creator_mode FROM games WHERE id = ?;",
-            (game_id,),
+    async with db() as conn:
+        # UNION сам убирает дубли; организатор попадает в выборку,
+        # только если он создавал матч «для себя» и его просили включить
+        cursor = await conn.execute(
+            """
+            SELECT applicant_id FROM game_applications
+            WHERE game_id = ? AND status = 'accepted'
+            UNION
+            SELECT creator_id FROM games
+            WHERE id = ? AND creator_mode = 'self' AND ? = 1;
+            """,
+            (game_id, game_id, 1 if include_creator else 0),
         )
-        row = await cursor.fetchone()
+        cursor.row_factory = None
+        rows = await cursor.fetchall()
         await cursor.close()
 
-        if not row:
-            return []
+    return [r[0] for r in rows]
 
-        creator_id = row["creator_id"]
-        creator_mode = row["creator_mode"]
 
-        participant_ids = set()
+# Именованные интервалы фильтра /games по времени начала: (от, до включительно)
+_TIME_RANGES = {
+    "morning": ("04:00", "10:00"),
+    "day": ("10:30", "16:00"),
+    "evening": ("16:30", "23:00"),
+}
+# Ночь переходит через полночь: (от, до) склеиваются через OR
+_NIGHT_RANGE = ("23:30", "03:30")
 
-        # Организатор считается участником, только если он создавал матч «для себя»
-        if include_creator and creator_mode == "self":
-            participant_ids.add(creator_id)
 
-        # Все принятые заявки
-        cursor = await db.execute(
-            """
-            SELECT applicant_id
-            FROM game_applications
-            WHERE game_id = ? AND status = 'accepted';
-            """,
-            (game_id,),
-        )
-        rows = await cursor.fetchall()
-        await cursor.close()
+def _build_listing_sql(has_date: bool, time_filter: Optional[str], only_home: bool, keyset: bool) -> str:
+    """
+    Текст запроса ленты зависит только от набора фильтров, а не от их значений.
+    Все варианты собираются при загрузке модуля (_LISTING_SQL): одинаковый
+    текст попадает в кэш prepared statements у sqlite3.
+    """
+    sql = """
+        SELECT g.*,
+               c.short_name AS court_short_name,
+               c.address AS court_address,
+               u.name AS creator_name,
+               u.ntrp AS creator_ntrp,""" + _ACCEPTED_COUNT_COL + """
+        FROM games g
+        JOIN courts c ON c.id = g.court_id
+        LEFT JOIN users u ON u.telegram_id = g.creator_id
+        WHERE g.is_active = 1
+          AND g.visibility = 'public'
+          AND g.status = 'scheduled'
+    """
+    if has_date:
+        sql += " AND g.match_date = ?"
+    if time_filter == "night":
+        sql += " AND (g.match_time >= ? OR g.match_time <= ?)"
+    elif time_filter in _TIME_RANGES:
+        sql += " AND g.match_time >= ? AND g.match_time <= ?"
+    elif time_filter:
+        sql += " AND g.match_time >= ?"
+    if only_home:
+        # id домашних кортов приходят одним JSON-параметром из кэша профиля:
+        # текст запроса не зависит от их числа, а user_home_courts не читаем
+        sql += " AND g.court_id IN (SELECT value FROM json_each(?))"
+    if keyset:
+        sql += " AND (g.match_date, g.match_time, g.id) > (?, ?, ?)"
+    sql += """
+        ORDER BY g.match_date, g.match_time, g.id
+        LIMIT ?
+    """
+    return sql
 
-        for r in rows:
-            participant_ids.add(r["applicant_id"])
 
-        return list(participant_ids)
+# (есть дата, вид фильтра по времени, только домашние, keyset) -> SQL
+_LISTING_SQL: dict[tuple, str] = {
+    key: _build_listing_sql(*key)
+    for key in product(
+        (False, True),
+        (None, "from", "night", *_TIME_RANGES),
+        (False, True),
+        (False, True),
+    )
+}
 
 
 async def get_games_for_listing(
@@ -1183,69 +2047,48 @@ async def get_games_for_listing(
     filter_time_from: Optional[str],
     only_home: bool,
     limit: int,
-    offset: int,
+    after: Optional[tuple] = None,
 ) -> List[aiosqlite.Row]:
     """
     Список публичных активных предстоящих матчей с учётом фильтров.
+    after — (match_date, match_time, id) последнего показанного матча:
+    следующая страница начинается сразу за ним (keyset вместо OFFSET).
     """
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        params: List = []
-        sql = """
-            SELECT g.*,
-                   c.short_name AS court_short_name,
-                   c.address AS court_address,
-                   u.name AS creator_name,
-                   u.ntrp AS creator_ntrp
-            FROM games g
-            JOIN courts c ON c.id = g.court_id
-            LEFT JOIN users u ON u.telegram_id = g.creator_id
-            WHERE g.is_active = 1
-              AND g.visibility = 'public'
-              AND g.status = 'scheduled'
-        """
+    params: tuple = ()
+    time_filter = None
+
+    if filter_date:
+        params += (filter_date,)
+
+    if filter_time_from:
+        if filter_time_from == "night":
+            time_filter = "night"
+            params += _NIGHT_RANGE
+        elif filter_time_from in _TIME_RANGES:
+            time_filter = filter_time_from
+            params += _TIME_RANGES[filter_time_from]
+        else:
+            # конкретное время «с ЧЧ:ММ»
+            time_filter = "from"
+            params += (filter_time_from,)
 
-        if filter_date:
-            sql += " AND g.match_date = ?"
-            params.append(filter_date)
-
-        if filter_time_from:
-            if filter_time_from == "morning":
-                sql += " AND g.match_time >= ? AND g.match_time <= ?"
-                params.extend(["04:00", "10:00"])
-            elif filter_time_from == "day":
-                sql += " AND g.match_time >= ? AND g.match_time <= ?"
-                params.extend(["10:30", "16:00"])
-            elif filter_time_from == "evening":
-                sql += " AND g.match_time >= ? AND g.match_time <= ?"
-                params.extend(["16:30", "23:00"])
-            elif filter_time_from == "night":
-                sql += " AND (g.match_time >= ? OR g.match_time <= ?)"
-                params.extend(["23:30", "03:30"])
-            else:
-                sql += " AND g.match_time >= ?"
-                params.append(filter_time_from)
-
-        if only_home:
-            sql += """
-              AND g.court_id IN (
-                  SELECT court_id
-                  FROM user_home_courts
-                  WHERE telegram_id = ?
-              )
-            """
-            params.append(user_id)
+    if only_home:
+        home_ids = [c.id for c in await get_user_home_courts(user_id)]
+        if not home_ids:
+            return []
+        params += (json.dumps(home_ids),)
 
-        sql += """
-            ORDER BY g.match_date, g.match_time
-            LIMIT ? OFFSET ?
-        """
-        params.extend([limit, offset])
+    if after:
+        params += tuple(after)
+
+    params += (limit,)
 
-        cursor = await db.execute(sql, params)
+    sql = _LISTING_SQL[bool(filter_date), time_filter, bool(only_home), bool(after)]
+    async with db() as conn:
+        cursor = await conn.execute(sql, params)
         rows = await cursor.fetchall()
         await cursor.close()
-        return list(rows)
+        return rows
 
 
 async def get_games_created_by_user(
@@ -1254,14 +2097,16 @@ async def get_games_created_by_user(
 ) -> List[aiosqlite.Row]:
     """
     Матчи, созданные пользователем.
+    Берём только колонки, которые нужны карточке в «Моих матчах».
     """
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
+    async with db() as conn:
         params: List = [creator_id]
         sql = """
-            SELECT g.*,
+            SELECT g.id, g.status, g.match_date, g.match_time, g.match_end_time,
+                   g.duration_minutes, g.rating_min, g.rating_max, g.is_court_booked,
+                   g.payment_type, g.comment, g.score, g.creator_mode, g.players_count,
                    c.short_name AS court_short_name,
-                   c.address AS court_address
+                   c.address AS court_address,""" + _ACCEPTED_COUNT_COL + """
             FROM games g
             JOIN courts c ON c.id = g.court_id
             WHERE g.creator_id = ?
@@ -1271,10 +2116,10 @@ async def get_games_created_by_user(
             params.append(status)
 
         sql += " ORDER BY g.match_date DESC, g.match_time DESC;"
-        cursor = await db.execute(sql, params)
+        cursor = await conn.execute(sql, params)
         rows = await cursor.fetchall()
         await cursor.close()
-        return list(rows)
+        return rows
 
 
 async def get_games_with_user_participation(user_id: int) -> List[aiosqlite.Row]:
@@ -1283,31 +2128,186 @@ async def get_games_with_user_participation(user_id: int) -> List[aiosqlite.Row]
     • есть принятая заявка на матч
     • или он сам создал матч в режиме "Создаю матч для себя" (creator_mode = 'self')
     """
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        cursor = await db.execute(
+    async with db() as conn:
+        cursor = await conn.execute(
             """
+            -- Две ветки вместо LEFT JOIN ... OR: каждая идёт по своему индексу
             SELECT g.*,
                    c.short_name AS court_short_name,
                    c.address AS court_address,
                    ga.status AS application_status,
                    u.name AS creator_name,
-                   u.ntrp AS creator_ntrp
+                   u.ntrp AS creator_ntrp,""" + _ACCEPTED_COUNT_COL + """
+            FROM game_applications ga
+            JOIN games g ON g.id = ga.game_id
+            JOIN courts c ON c.id = g.court_id
+            LEFT JOIN users u ON u.telegram_id = g.creator_id
+            WHERE ga.applicant_id = ?
+              AND ga.status = 'accepted'
+
+            UNION ALL
+
+            SELECT g.*,
+                   c.short_name AS court_short_name,
+                   c.address AS court_address,
+                   NULL AS application_status,
+                   u.name AS creator_name,
+                   u.ntrp AS creator_ntrp,""" + _ACCEPTED_COUNT_COL + """
             FROM games g
             JOIN courts c ON c.id = g.court_id
-            LEFT JOIN game_applications ga
-              ON ga.game_id = g.id
-             AND ga.applicant_id = ?
-             AND ga.status = 'accepted'
             LEFT JOIN users u ON u.telegram_id = g.creator_id
-            WHERE (ga.id IS NOT NULL)
-               OR (g.creator_id = ? AND g.creator_mode = 'self');
+            WHERE g.creator_id = ?
+              AND g.creator_mode = 'self'
+              -- матч уже попал в первую ветку
+              AND NOT EXISTS (
+                  SELECT 1 FROM game_applications ga
+                  WHERE ga.game_id = g.id
+                    AND ga.applicant_id = g.creator_id
+                    AND ga.status = 'accepted'
+              )
+
+            ORDER BY id;
             """,
             (user_id, user_id),
         )
         rows = await cursor.fetchall()
         await cursor.close()
-        return list(rows)
+        return rows
+
+
+# -----------------------------------------
+# Middleware: апдейты одного чата — по очереди
+# -----------------------------------------
+
+class PerChatLockMiddleware(BaseMiddleware):
+    """
+    Апдейты одного чата обрабатываются строго по очереди (FSM не гоняется
+    сам с собой), а разные чаты — параллельно. Лок живёт, пока на него
+    есть хотя бы один апдейт, поэтому словарь не растёт с числом чатов.
+    """
+
+    def __init__(self):
+        self._locks: Dict[int, asyncio.Lock] = {}
+        self._users: Dict[int, int] = {}
+
+    async def __call__(
+        self,
+        handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
+        event: Any,
+        data: Dict[str, Any],
+    ) -> Any:
+        chat = data.get("event_chat")
+        if chat is None:
+            return await handler(event, data)
+
+        chat_id = chat.id
+        lock = self._locks.get(chat_id)
+        if lock is None:
+            lock = self._locks[chat_id] = asyncio.Lock()
+        self._users[chat_id] = self._users.get(chat_id, 0) + 1
+        try:
+            async with lock:
+                return await handler(event, data)
+        finally:
+            self._users[chat_id] -= 1
+            if not self._users[chat_id]:
+                del self._users[chat_id]
+                del self._locks[chat_id]
+
+
+# outer — чтобы лок брался до фильтров по состоянию FSM
+_per_chat_lock = PerChatLockMiddleware()
+dp.message.outer_middleware(_per_chat_lock)
+dp.callback_query.outer_middleware(_per_chat_lock)
+
+
+class TokenBucket:
+    """Token bucket: rate токенов в секунду, в запасе не больше capacity."""
+
+    __slots__ = ("rate", "capacity", "_tokens", "_updated", "_lock")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def is_idle(self, now: float) -> bool:
+        return self._tokens + (now - self._updated) * self.rate >= self.capacity
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                self._refill(time.monotonic())
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class TelegramRateLimitMiddleware(BaseRequestMiddleware):
+    """
+    Придерживает исходящие запросы к Bot API, чтобы не упираться в 429:
+    общий лимит на бота и отдельный на каждый чат. Если Telegram всё же
+    ответил RetryAfter — ждём сколько сказали и повторяем один раз.
+    """
+
+    def __init__(self):
+        self._global = TokenBucket(TG_GLOBAL_RATE, TG_GLOBAL_RATE)
+        self._chats: Dict[int, TokenBucket] = {}
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= 1024:
+                # выкидываем корзины чатов, которые давно ничего не отправляли
+                now = time.monotonic()
+                self._chats = {
+                    cid: b for cid, b in self._chats.items() if not b.is_idle(now)
+                }
+            bucket = self._chats[chat_id] = TokenBucket(TG_CHAT_RATE, TG_CHAT_BURST)
+        return bucket
+
+    async def __call__(self, make_request, bot, method):
+        # long polling не ограничиваем
+        if isinstance(method, GetUpdates):
+            return await make_request(bot, method)
+
+        chat_id = getattr(method, "chat_id", None)
+        if isinstance(chat_id, int):
+            await self._chat_bucket(chat_id).acquire()
+        await self._global.acquire()
+
+        try:
+            return await make_request(bot, method)
+        except TelegramRetryAfter as e:
+            logger.warning("Telegram flood control, retry in %s s", e.retry_after)
+            await asyncio.sleep(e.retry_after)
+            return await make_request(bot, method)
+
+
+bot.session.middleware(TelegramRateLimitMiddleware())
+
+
+async def send_to_chats(messages: List[tuple[int, str]], what: str):
+    """
+    Рассылает сообщения по разным чатам параллельно: лимиты держит
+    TelegramRateLimitMiddleware, у каждого чата своя корзина. Ошибка
+    одного получателя (например, бот заблокирован) не мешает остальным.
+    В один чат так слать нельзя — Telegram может переставить сообщения.
+    """
+    results = await asyncio.gather(
+        *(bot.send_message(chat_id, text) for chat_id, text in messages),
+        return_exceptions=True,
+    )
+    for (chat_id, _), result in zip(messages, results):
+        if isinstance(result, Exception):
+            logger.error("Failed to send %s to %s: %r", what, chat_id, result)
 
 
 # -----------------------------------------
@@ -1316,8 +2316,7 @@ async def get_games_with_user_participation(user_id: int) -> List[aiosqlite.Row]
 
 @dp.message(CommandStart())
 async def start_cmd(message: Message, state: FSMContext):
-    await update_username_only(message.from_user.id, message.from_user.username)
-    user = await get_user(message.from_user.id)
+    user = await upsert_username_and_get(message.from_user.id, message.from_user.username)
 
     if user:
         await state.clear()
@@ -1340,15 +2339,14 @@ async def start_cmd(message: Message, state: FSMContext):
         "Привет 👋\nМеня зовут TennisBot.\n"
         "Сейчас за пару минут настроим твой теннисный профиль.\n\n"
         "Как тебя подписывать?",
-        reply_markup=ReplyKeyboardRemove(),
+        reply_markup=remove_kb,
     )
     await state.set_state(Onboarding.name)
 
 
 @dp.message(F.text == "/me")
 async def profile_cmd(message: Message):
-    await update_username_only(message.from_user.id, message.from_user.username)
-    user = await get_user(message.from_user.id)
+    user = await upsert_username_and_get(message.from_user.id, message.from_user.username)
 
     if not user:
         await message.answer("Ты ещё не проходил анкету. Жми /start")
@@ -1369,9 +2367,9 @@ async def profile_cmd(message: Message):
     if home_courts:
         lines.append("")
         lines.append("Домашние корты:")
-        for row in home_courts:
-            addr = row["address"] or "Адрес не указан"
-            lines.append(f"• {row['short_name']} — <i>📍 {addr}</i>")
+        for court in home_courts:
+            addr = court.address or "Адрес не указан"
+            lines.append(f"• {court.short_name} — <i>📍 {addr}</i>")
     else:
         lines.append("")
         lines.append("Домашние корты: не выбраны")
@@ -1396,14 +2394,13 @@ async def reset_cmd(message: Message, state: FSMContext):
     await message.answer(
         "Я сбросил твою анкету и данные профиля.\n\n"
         "Теперь можно пройти всё заново — жми /start 🙂",
-        reply_markup=ReplyKeyboardRemove(),
+        reply_markup=remove_kb,
     )
 
 
 @dp.message(F.text == "/edit")
 async def edit_cmd(message: Message, state: FSMContext):
-    await update_username_only(message.from_user.id, message.from_user.username)
-    user = await get_user(message.from_user.id)
+    user = await upsert_username_and_get(message.from_user.id, message.from_user.username)
     if not user:
         await message.answer(
             "Пока у тебя нет профиля.\nСначала пройди анкету через /start 🙂"
@@ -1419,45 +2416,52 @@ async def edit_cmd(message: Message, state: FSMContext):
 
 # ---------- Редактор профиля ----------
 
+# Пункты меню /edit с простым вводом: кнопка -> (состояние, подсказка, клавиатура)
+_EDIT_FIELD_PROMPTS = {
+    "Имя": (EditProfile.name, "Введи новое имя:", remove_kb),
+    "Пол": (EditProfile.gender, "Выбери пол:", gender_kb),
+    "Город": (
+        EditProfile.city,
+        "Напиши новый город, в котором ты обычно играешь:",
+        remove_kb,
+    ),
+    "Дата рождения": (
+        EditProfile.birth_date,
+        "Введи новую дату рождения в формате ДД.ММ.ГГГГ\n"
+        "Например: 31.12.1990",
+        remove_kb,
+    ),
+    "О себе": (
+        EditProfile.about,
+        "Напиши новый текст «о себе».\n"
+        "Если передумаешь — отправь слово «Пропустить».",
+        remove_kb,
+    ),
+    "Фото": (
+        EditProfile.photo,
+        "Отправь новое фото для профиля 📷\n"
+        "Или отправь «Пропустить», если не хочешь менять.",
+        remove_kb,
+    ),
+}
+
+
 @dp.message(EditProfile.choose_field)
 async def edit_choose_field(message: Message, state: FSMContext):
     text = (message.text or "").strip()
 
-    if text == "Имя":
-        await state.set_state(EditProfile.name)
-        await message.answer(
-            "Введи новое имя:",
-            reply_markup=ReplyKeyboardRemove(),
-        )
-
-    elif text == "Пол":
-        await state.set_state(EditProfile.gender)
-        await message.answer(
-            "Выбери пол:",
-            reply_markup=gender_kb,
-        )
-
-    elif text == "Город":
-        await state.set_state(EditProfile.city)
-        await message.answer(
-            "Напиши новый город, в котором ты обычно играешь:",
-            reply_markup=ReplyKeyboardRemove(),
-        )
-
-    elif text == "Дата рождения":
-        await state.set_state(EditProfile.birth_date)
-        await message.answer(
-            "Введи новую дату рождения в формате ДД.ММ.ГГГГ\n"
-            "Например: 31.12.1990",
-            reply_markup=ReplyKeyboardRemove(),
-        )
+    entry = _EDIT_FIELD_PROMPTS.get(text)
+    if entry is not None:
+        next_state, prompt, markup = entry
+        await state.set_state(next_state)
+        await message.answer(prompt, reply_markup=markup)
 
     elif text == "Домашние корты":
         courts = await get_active_courts()
         if not courts:
             await message.answer(
                 "Пока нет доступных кортов для выбора. Обратись к админу.",
-                reply_markup=ReplyKeyboardRemove(),
+                reply_markup=remove_kb,
             )
             await state.clear()
             return
@@ -1471,27 +2475,11 @@ async def edit_choose_field(message: Message, state: FSMContext):
             reply_markup=build_home_courts_kb(courts),
         )
 
-    elif text == "О себе":
-        await state.set_state(EditProfile.about)
-        await message.answer(
-            "Напиши новый текст «о себе».\n"
-            "Если передумаешь — отправь слово «Пропустить».",
-            reply_markup=ReplyKeyboardRemove(),
-        )
-
-    elif text == "Фото":
-        await state.set_state(EditProfile.photo)
-        await message.answer(
-            "Отправь новое фото для профиля 📷\n"
-            "Или отправь «Пропустить», если не хочешь менять.",
-            reply_markup=ReplyKeyboardRemove(),
-        )
-
     elif text == "Отмена":
         await state.clear()
         await message.answer(
             "Окей, ничего не меняем 🙂",
-            reply_markup=ReplyKeyboardRemove(),
+            reply_markup=remove_kb,
         )
 
     else:
@@ -1508,45 +2496,30 @@ async def edit_name(message: Message, state: FSMContext):
         await message.answer("Имя не может быть пустым. Попробуй ещё раз 🙂")
         return
 
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "UPDATE users SET name = ? WHERE telegram_id = ?;",
-            (name, message.from_user.id),
-        )
-        await db.commit()
+    await update_user_field(message.from_user.id, "name", name)
 
     await state.clear()
     await message.answer(
         f"Имя обновлено: {name}\n\n"
         "Посмотреть профиль → /me",
-        reply_markup=ReplyKeyboardRemove(),
+        reply_markup=remove_kb,
     )
 
 
 @dp.message(EditProfile.gender)
 async def edit_gender(message: Message, state: FSMContext):
-    gender_raw = (message.text or "").strip().lower()
-
-    if gender_raw.startswith("муж"):
-        gender = "Мужчина"
-    elif gender_raw.startswith("жен"):
-        gender = "Женщина"
-    else:
+    gender = parse_gender(message.text or "")
+    if gender is None:
         await message.answer("Пожалуйста, выбери один из вариантов на клавиатуре 🙂")
         return
 
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "UPDATE users SET gender = ? WHERE telegram_id = ?;",
-            (gender, message.from_user.id),
-        )
-        await db.commit()
+    await update_user_field(message.from_user.id, "gender", gender)
 
     await state.clear()
     await message.answer(
         f"Пол обновлён: {gender}\n\n"
         "Посмотреть профиль → /me",
-        reply_markup=ReplyKeyboardRemove(),
+        reply_markup=remove_kb,
     )
 
 
@@ -1557,18 +2530,13 @@ async def edit_city(message: Message, state: FSMContext):
         await message.answer("Нужно указать город текстом. Попробуй ещё раз 🙂")
         return
 
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "UPDATE users SET city = ? WHERE telegram_id = ?;",
-            (city, message.from_user.id),
-        )
-        await db.commit()
+    await update_user_field(message.from_user.id, "city", city)
 
     await state.clear()
     await message.answer(
         f"Город обновлён: {city}\n\n"
         "Посмотреть профиль → /me",
-        reply_markup=ReplyKeyboardRemove(),
+        reply_markup=remove_kb,
     )
 
 
@@ -1576,14 +2544,15 @@ async def edit_city(message: Message, state: FSMContext):
 async def edit_birth_date(message: Message, state: FSMContext):
     text = (message.text or "").strip()
 
-    if not re.match(r"^\d{2}\.\d{2}\.\d{4}$", text):
+    m = _STRICT_DATE_RE.match(text)
+    if not m:
         await message.answer(
             "Не похоже на дату 😅\n"
             "Нужен формат ДД.ММ.ГГГГ, например: 31.12.1990",
         )
         return
 
-    age = calculate_age_from_str(text)
+    age = calculate_age(*map(int, m.groups()))
     if age is None:
         await message.answer(
             "Не получилось обработать дату рождения.\n"
@@ -1605,18 +2574,13 @@ async def edit_birth_date(message: Message, state: FSMContext):
         )
         return
 
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "UPDATE users SET birth_date = ? WHERE telegram_id = ?;",
-            (text, message.from_user.id),
-        )
-        await db.commit()
+    await update_user_field(message.from_user.id, "birth_date", text)
 
     await state.clear()
     await message.answer(
         "Дата рождения обновлена ✅\n\n"
         "Посмотреть профиль → /me",
-        reply_markup=ReplyKeyboardRemove(),
+        reply_markup=remove_kb,
     )
 
 
@@ -1626,16 +2590,12 @@ async def edit_home_courts(message: Message, state: FSMContext):
     data = await state.get_data()
     selected_ids: List[int] = data.get("home_courts", []) or []
 
-    courts = await get_active_courts()
-    name_to_id = {c["short_name"]: c["id"] for c in courts}
-    name_to_addr = {c["short_name"]: c["address"] for c in courts}
-
     if text == HOME_SKIP:
         # Ничего не меняем
         await state.clear()
         await message.answer(
             "Домашние корты оставлены без изменений.",
-            reply_markup=ReplyKeyboardRemove(),
+            reply_markup=remove_kb,
         )
         return
 
@@ -1643,25 +2603,26 @@ async def edit_home_courts(message: Message, state: FSMContext):
         await save_user_home_courts(message.from_user.id, selected_ids)
         await state.clear()
         if selected_ids:
-            id_to_name = {c["id"]: c["short_name"] for c in courts}
-            chosen_names = [id_to_name.get(cid, str(cid)) for cid in selected_ids]
+            chosen_names = await get_court_names(selected_ids)
             summary = "Твои домашние корты обновлены: " + ", ".join(chosen_names)
         else:
             summary = "Ты не выбрал ни одного домашнего корта."
         await message.answer(
             summary + "\n\nПосмотреть профиль → /me",
-            reply_markup=ReplyKeyboardRemove(),
+            reply_markup=remove_kb,
         )
         return
 
-    if text not in name_to_id:
+    courts = await get_active_courts()
+    court = await get_active_court_by_name(text)
+    if court is None:
         await message.answer(
             "Пожалуйста, выбери корт из списка или нажми «Готово ✅» / «Пропустить».",
             reply_markup=build_home_courts_kb(courts),
         )
         return
 
-    cid = name_to_id[text]
+    cid = court.id
     if cid in selected_ids:
         selected_ids.remove(cid)
         action = "убрал"
@@ -1669,16 +2630,15 @@ async def edit_home_courts(message: Message, state: FSMContext):
         selected_ids.append(cid)
         action = "добавил"
 
-    await state.update_data(home_courts=selected_ids)
+    await patch_state(state, data, home_courts=selected_ids)
 
-    id_to_name = {c["id"]: c["short_name"] for c in courts}
     if selected_ids:
-        chosen_names = [id_to_name.get(x, str(x)) for x in selected_ids]
+        chosen_names = await get_court_names(selected_ids)
         selected_str = "Сейчас выбрано: " + ", ".join(chosen_names)
     else:
         selected_str = "Сейчас ничего не выбрано."
 
-    address = name_to_addr.get(text) or "Адрес не указан"
+    address = court.address or "Адрес не указан"
 
     await message.answer(
         f"Я {action} «{text}» в список домашних кортов.\n"
@@ -1694,48 +2654,39 @@ async def edit_home_courts(message: Message, state: FSMContext):
 async def edit_about(message: Message, state: FSMContext):
     text = (message.text or "").strip()
 
-    if text.lower().startswith("пропус"):
+    if is_skip_answer(text):
         about = None
     else:
         about = text
 
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "UPDATE users SET about = ? WHERE telegram_id = ?;",
-            (about, message.from_user.id),
-        )
-        await db.commit()
+    await update_user_field(message.from_user.id, "about", about)
 
     await state.clear()
     await message.answer(
         "Текст «о себе» обновлён ✅\n\n"
         "Посмотреть профиль → /me",
-        reply_markup=ReplyKeyboardRemove(),
+        reply_markup=remove_kb,
     )
 
 
 @dp.message(EditProfile.photo)
 async def edit_photo(message: Message, state: FSMContext):
-    if message.text and message.text.strip().lower().startswith("пропус"):
-        photo_file_id = None
-    elif message.photo:
+    # чаще всего приходит само фото — его и проверяем первым
+    if message.photo:
         photo_file_id = message.photo[-1].file_id
+    elif message.text and is_skip_answer(message.text):
+        photo_file_id = None
     else:
         await message.answer("Пожалуйста, отправь фото или «Пропустить» 🙂")
         return
 
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "UPDATE users SET photo_file_id = ? WHERE telegram_id = ?;",
-            (photo_file_id, message.from_user.id),
-        )
-        await db.commit()
+    await update_user_field(message.from_user.id, "photo_file_id", photo_file_id)
 
     await state.clear()
     await message.answer(
         "Фото профиля обновлено ✅\n\n"
         "Посмотреть профиль → /me",
-        reply_markup=ReplyKeyboardRemove(),
+        reply_markup=remove_kb,
     )
 
 # ---------- Поддержка: /help ----------
@@ -1755,7 +2706,7 @@ async def help_cmd(message: Message, state: FSMContext):
     await message.answer(
         "Напиши в одном сообщении, что случилось или какой вопрос.\n"
         "Я передам это админу 🙂",
-        reply_markup=ReplyKeyboardRemove(),
+        reply_markup=remove_kb,
     )
 
 
@@ -1803,6 +2754,16 @@ async def help_text_handler(message: Message, state: FSMContext):
         "Если нужно, он свяжется с тобой в Телеграме.",
     )
 
+# ---------- Админ: перечитать справочник кортов ----------
+
+@dp.message(F.text == "/reload_courts")
+async def reload_courts_cmd(message: Message):
+    if not ADMIN_CHAT_ID or message.from_user.id != int(ADMIN_CHAT_ID):
+        return
+    await refresh_courts()
+    courts = await get_active_courts()
+    await message.answer(f"Справочник кортов обновлён: активных кортов — {len(courts)}.")
+
 # -----------------------------------------
 # Онбординг
 # -----------------------------------------
@@ -1822,13 +2783,8 @@ async def get_name(message: Message, state: FSMContext):
 
 @dp.message(Onboarding.gender)
 async def get_gender(message: Message, state: FSMContext):
-    gender_raw = (message.text or "").strip().lower()
-
-    if gender_raw.startswith("муж"):
-        gender = "Мужчина"
-    elif gender_raw.startswith("жен"):
-        gender = "Женщина"
-    else:
+    gender = parse_gender(message.text or "")
+    if gender is None:
         await message.answer("Пожалуйста, выбери один из вариантов на клавиатуре 🙂")
         return
 
@@ -1851,26 +2807,25 @@ async def get_city(message: Message, state: FSMContext):
         city = "Москва"
         manual = False
     elif text == "Другой город" and not data.get("city_manual"):
-        await state.update_data(city_manual=True)
+        await patch_state(state, data, city_manual=True)
         await message.answer(
             "Ок, напиши, пожалуйста, свой город текстом.",
-            reply_markup=ReplyKeyboardRemove(),
+            reply_markup=remove_kb,
         )
         return
     else:
         city = text
         manual = data.get("city_manual", False)
 
-    await state.update_data(city=city, city_manual=manual)
+    await patch_state(state, data, city=city, city_manual=manual, home_courts=[])
 
     courts = await get_active_courts()
     if not courts:
         await message.answer(
             "Пока я не знаю теннисные корты в этом городе, пропускаем этот шаг.\n"
             "Позже админ добавит список кортов.",
-            reply_markup=ReplyKeyboardRemove(),
+            reply_markup=remove_kb,
         )
-        await state.update_data(home_courts=[])
         await message.answer(
             "Теперь давай оценим твой уровень по шкале NTRP.",
             reply_markup=ntrp_kb,
@@ -1878,7 +2833,6 @@ async def get_city(message: Message, state: FSMContext):
         await state.set_state(Onboarding.ntrp)
         return
 
-    await state.update_data(home_courts=[])
     await message.answer(
         "Выбери один или несколько домашних кортов.\n"
         "Нажимай по кнопкам, чтобы добавить/убрать корт.\n"
@@ -1896,7 +2850,7 @@ async def home_courts_handler(message: Message, state: FSMContext):
 
     # Пропустить
     if text == HOME_SKIP:
-        await state.update_data(home_courts=[])
+        await patch_state(state, data, home_courts=[])
         await message.answer(
             "Окей, пока без домашних кортов.\n\n"
             "Теперь давай оценим твой уровень по шкале NTRP.",
@@ -1907,17 +2861,15 @@ async def home_courts_handler(message: Message, state: FSMContext):
 
     # Готово
     if text == HOME_DONE:
-        courts = await get_active_courts()
-        id_to_name = {c["id"]: c["short_name"] for c in courts}
         if selected_ids:
-            chosen_names = [id_to_name.get(cid, str(cid)) for cid in selected_ids]
+            chosen_names = await get_court_names(selected_ids)
             summary = "Твои домашние корты: " + ", ".join(chosen_names)
         else:
             summary = "Ты не выбрал ни одного домашнего корта."
 
         await message.answer(
             summary,
-            reply_markup=ReplyKeyboardRemove(),
+            reply_markup=remove_kb,
         )
         await message.answer(
             "Теперь давай оценим твой уровень по шкале NTRP.",
@@ -1928,17 +2880,15 @@ async def home_courts_handler(message: Message, state: FSMContext):
 
     # Обычный корт
     courts = await get_active_courts()
-    name_to_id = {c["short_name"]: c["id"] for c in courts}
-    name_to_addr = {c["short_name"]: c["address"] for c in courts}
-
-    if text not in name_to_id:
+    court = await get_active_court_by_name(text)
+    if court is None:
         await message.answer(
             "Пожалуйста, выбери корт из списка или нажми «Готово ✅» / «Пропустить».",
             reply_markup=build_home_courts_kb(courts),
         )
         return
 
-    cid = name_to_id[text]
+    cid = court.id
     if cid in selected_ids:
         selected_ids.remove(cid)
         action = "убрал"
@@ -1946,16 +2896,15 @@ async def home_courts_handler(message: Message, state: FSMContext):
         selected_ids.append(cid)
         action = "добавил"
 
-    await state.update_data(home_courts=selected_ids)
+    await patch_state(state, data, home_courts=selected_ids)
 
-    id_to_name = {c["id"]: c["short_name"] for c in courts}
     if selected_ids:
-        chosen_names = [id_to_name.get(x, str(x)) for x in selected_ids]
+        chosen_names = await get_court_names(selected_ids)
         selected_str = "Сейчас выбрано: " + ", ".join(chosen_names)
     else:
         selected_str = "Сейчас ничего не выбрано."
 
-    address = name_to_addr.get(text) or "Адрес не указан"
+    address = court.address or "Адрес не указан"
 
     await message.answer(
         f"Я {action} «{text}» в список домашних кортов.\n"
@@ -1974,27 +2923,25 @@ async def get_ntrp(message: Message, state: FSMContext):
     waiting_custom = data.get("waiting_custom_ntrp", False)
 
     if text.startswith("Ввести свой уровень"):
-        await state.update_data(waiting_custom_ntrp=True)
+        await patch_state(state, data, waiting_custom_ntrp=True)
         await message.answer(
             "Введи свой уровень NTRP числом от 1.00 до 7.00.\n"
             "Например: 3.25",
-            reply_markup=ReplyKeyboardRemove(),
+            reply_markup=remove_kb,
         )
         return
 
     if waiting_custom:
-        raw = text.replace(",", ".")
-        try:
-            value = float(raw)
-        except ValueError:
+        value = parse_ntrp_number(text)
+        if value is None:
             await message.answer(
                 "Не удалось распознать число 🤔\n"
-                "Пример: 3.25",
+                "Нужно значение от 1.00 до 7.00, например: 3.25",
             )
             return
 
         value = normalize_custom_ntrp(value)
-        await state.update_data(ntrp_self=value, waiting_custom_ntrp=False)
+        await patch_state(state, data, ntrp_self=value, waiting_custom_ntrp=False)
     else:
         base_ntrp = parse_ntrp_from_button(text)
         if base_ntrp is None:
@@ -2003,7 +2950,7 @@ async def get_ntrp(message: Message, state: FSMContext):
                 reply_markup=ntrp_kb,
             )
             return
-        await state.update_data(ntrp_self=base_ntrp)
+        await patch_state(state, data, ntrp_self=base_ntrp)
 
     await message.answer(
         "Как давно ты играл в большой теннис?",
@@ -2016,12 +2963,7 @@ async def get_ntrp(message: Message, state: FSMContext):
 async def get_play_experience(message: Message, state: FSMContext):
     text = (message.text or "").strip()
 
-    if text not in [
-        "Нет, никогда",
-        "Да, в этом году",
-        "Да, более года назад",
-        "Да, более пяти лет назад",
-    ]:
+    if text not in _PE_MOD:
         await message.answer("Пожалуйста, выбери один из вариантов на клавиатуре 🙂")
         return
 
@@ -2038,11 +2980,7 @@ async def get_play_experience(message: Message, state: FSMContext):
 async def get_matches_6m(message: Message, state: FSMContext):
     text = (message.text or "").strip()
 
-    if text not in [
-        "0–10 матчей",
-        "10–100 матчей",
-        "100 и более",
-    ]:
+    if text not in _M6_MOD:
         await message.answer("Пожалуйста, выбери один из вариантов на клавиатуре 🙂")
         return
 
@@ -2059,11 +2997,7 @@ async def get_matches_6m(message: Message, state: FSMContext):
 async def get_fitness(message: Message, state: FSMContext):
     text = (message.text or "").strip()
 
-    if text not in [
-        "Низкая",
-        "Хорошая",
-        "Отличная",
-    ]:
+    if text not in _FIT_MOD:
         await message.answer("Пожалуйста, выбери один из вариантов на клавиатуре 🙂")
         return
 
@@ -2082,11 +3016,7 @@ async def get_fitness(message: Message, state: FSMContext):
 async def get_tournaments(message: Message, state: FSMContext):
     text = (message.text or "").strip()
 
-    if text not in [
-        "Не участвовал",
-        "Tour",
-        "Masters",
-    ]:
+    if text not in _TOUR_MOD:
         await message.answer("Пожалуйста, выбери один из вариантов на клавиатуре 🙂")
         return
 
@@ -2095,7 +3025,7 @@ async def get_tournaments(message: Message, state: FSMContext):
     await message.answer(
         "Укажи дату рождения в формате ДД.ММ.ГГГГ\n"
         "Например: 31.12.1990",
-        reply_markup=ReplyKeyboardRemove(),
+        reply_markup=remove_kb,
     )
     await state.set_state(Onboarding.birth_date)
 
@@ -2104,14 +3034,15 @@ async def get_tournaments(message: Message, state: FSMContext):
 async def get_birth_date(message: Message, state: FSMContext):
     text = (message.text or "").strip()
 
-    if not re.match(r"^\d{2}\.\d{2}\.\d{4}$", text):
+    m = _STRICT_DATE_RE.match(text)
+    if not m:
         await message.answer(
             "Не похоже на дату 😅\n"
             "Нужен формат ДД.ММ.ГГГГ, например: 31.12.1990",
         )
         return
 
-    age = calculate_age_from_str(text)
+    age = calculate_age(*map(int, m.groups()))
     if age is None:
         await message.answer(
             "Не получилось обработать дату рождения.\n"
@@ -2147,7 +3078,7 @@ async def get_birth_date(message: Message, state: FSMContext):
 async def get_about(message: Message, state: FSMContext):
     text = (message.text or "").strip()
 
-    if text.lower().startswith("пропус"):
+    if is_skip_answer(text):
         about = None
     else:
         about = text
@@ -2164,10 +3095,11 @@ async def get_about(message: Message, state: FSMContext):
 
 @dp.message(Onboarding.photo)
 async def get_photo(message: Message, state: FSMContext):
-    if message.text and message.text.strip().lower().startswith("пропус"):
-        photo_file_id = None
-    elif message.photo:
+    # чаще всего приходит само фото — его и проверяем первым
+    if message.photo:
         photo_file_id = message.photo[-1].file_id
+    elif message.text and is_skip_answer(message.text):
+        photo_file_id = None
     else:
         await message.answer("Пожалуйста, отправь фото или нажми «Пропустить» 🙂")
         return
@@ -2194,7 +3126,7 @@ async def get_photo(message: Message, state: FSMContext):
         tournaments=tournaments,
     )
 
-    await upsert_user(
+    user_row = dict(
         tg_id=message.from_user.id,
         username=message.from_user.username,
         name=data.get("name"),
@@ -2212,14 +3144,14 @@ async def get_photo(message: Message, state: FSMContext):
     )
 
     home_courts_ids: List[int] = data.get("home_courts", []) or []
-    await save_user_home_courts(message.from_user.id, home_courts_ids)
+    await save_onboarding(user_row, home_courts_ids)
 
     await message.answer(
         "Профиль сохранён! 🎾\n\n"
         f"Твой текущий рейтинг NTRP: {final_ntrp:.2f}\n\n"
         "Он будет меняться после сыгранных матчей.\n\n"
         "Посмотреть профиль → /me",
-        reply_markup=ReplyKeyboardRemove(),
+        reply_markup=remove_kb,
     )
 
 # -----------------------------------------
@@ -2228,8 +3160,7 @@ async def get_photo(message: Message, state: FSMContext):
 
 @dp.message(F.text == "/newgame")
 async def newgame_cmd(message: Message, state: FSMContext):
-    await update_username_only(message.from_user.id, message.from_user.username)
-    user = await get_user(message.from_user.id)
+    user = await upsert_username_and_get(message.from_user.id, message.from_user.username)
     if not user:
         await message.answer(
             "Сначала нужно заполнить профиль.\n"
@@ -2241,13 +3172,12 @@ async def newgame_cmd(message: Message, state: FSMContext):
     if not courts:
         await message.answer(
             "В базе пока нет ни одного корта. Обратись к админу.",
-            reply_markup=ReplyKeyboardRemove(),
+            reply_markup=remove_kb,
         )
         return
 
     await state.clear()
-    await state.update_data(creator_mode="self")
-    await state.set_state(NewGame.court)
+    await advance_state(state, NewGame.court, creator_mode="self")
     await message.answer(
         "Создаём новый матч 🎾\n\n"
         "Выбери корт, на котором планируешь играть:",
@@ -2260,28 +3190,24 @@ async def newgame_creator_mode(message: Message, state: FSMContext):
     text = (message.text or "").strip()
     if text == "Отмена":
         await state.clear()
-        await message.answer("Создание игры отменено.", reply_markup=ReplyKeyboardRemove())
+        await message.answer("Создание игры отменено.", reply_markup=remove_kb)
         return
 
-    if text == "Создаю матч для себя":
-        mode = "self"
-    elif text == "Создаю матч для других":
-        mode = "others"
-    else:
+    mode = CREATOR_MODE_BY_TEXT.get(text)
+    if mode is None:
         await message.answer(
             "Пожалуйста, выбери один из вариантов на клавиатуре 🙂",
             reply_markup=creator_mode_kb,
         )
         return
 
-    await state.update_data(creator_mode=mode)
-    await state.set_state(NewGame.court)
+    await advance_state(state, NewGame.court, creator_mode=mode)
 
     courts = await get_active_courts()
     if not courts:
         await message.answer(
             "В базе пока нет ни одного корта. Обратись к админу.",
-            reply_markup=ReplyKeyboardRemove(),
+            reply_markup=remove_kb,
         )
         await state.clear()
         return
@@ -2297,45 +3223,44 @@ async def newgame_court(message: Message, state: FSMContext):
     text = (message.text or "").strip()
     if text == "Отмена":
         await state.clear()
-        await message.answer("Создание игры отменено.", reply_markup=ReplyKeyboardRemove())
+        await message.answer("Создание игры отменено.", reply_markup=remove_kb)
         return
 
-    courts = await get_active_courts()
-    name_to_id = {c["short_name"]: c["id"] for c in courts}
-
-    if text not in name_to_id:
+    court = await get_active_court_by_name(text)
+    if court is None:
         await message.answer(
             "Пожалуйста, выбери корт из списка или нажми «Отмена».",
-            reply_markup=build_courts_single_kb(courts),
+            reply_markup=build_courts_single_kb(await get_active_courts()),
         )
         return
 
-    cid = name_to_id[text]
-    await state.update_data(court_id=cid, court_name=text)
-
-    await state.set_state(NewGame.date_choice)
+    cid = court.id
+    await advance_state(state, NewGame.date_choice, court_id=cid, court_name=text)
     await message.answer(
         "Выбери дату матча:",
         reply_markup=date_choice_kb,
     )
 
 
+# Быстрые кнопки выбора даты -> сдвиг от сегодняшнего дня
+_DATE_CHOICE_OFFSETS = {"Сегодня": timedelta(0), "Завтра": _ONE_DAY}
+
+
 @dp.message(NewGame.date_choice)
 async def newgame_date_choice(message: Message, state: FSMContext):
     text = (message.text or "").strip()
 
     today = get_moscow_today()
 
-    if text == "Сегодня":
-        match_date_obj = today
-    elif text == "Завтра":
-        match_date_obj = today + timedelta(days=1)
+    offset = _DATE_CHOICE_OFFSETS.get(text)
+    if offset is not None:
+        match_date_obj = today + offset
     elif text == "Ввести дату":
         await state.set_state(NewGame.date_manual)
         await message.answer(
             "Укажи дату матча в формате ДД.ММ.ГГГГ\n"
             "Например: 25.11.2024",
-            reply_markup=ReplyKeyboardRemove(),
+            reply_markup=remove_kb,
         )
         return
     else:
@@ -2345,7 +3270,7 @@ async def newgame_date_choice(message: Message, state: FSMContext):
         )
         return
 
-    max_date = today + timedelta(days=MAX_MATCH_DAYS_AHEAD)
+    max_date = today + _MAX_AHEAD
     if match_date_obj < today:
         await message.answer(
             "Нельзя создать матч в прошлом.\n"
@@ -2395,7 +3320,8 @@ async def newgame_date_choice(message: Message, state: FSMContext):
 async def newgame_date_manual(message: Message, state: FSMContext):
     text = (message.text or "").strip()
 
-    if not re.match(r"^\d{2}\.\d{2}\.\d{4}$", text):
+    m = _STRICT_DATE_RE.match(text)
+    if not m:
         await message.answer(
             "Не похоже на дату 😅\n"
             "Нужен формат ДД.ММ.ГГГГ, например: 25.11.2024",
@@ -2403,7 +3329,7 @@ async def newgame_date_manual(message: Message, state: FSMContext):
         return
 
     try:
-        day, month, year = map(int, text.split("."))
+        day, month, year = map(int, m.groups())
         match_date_obj = date(year, month, day)
     except ValueError:
         await message.answer(
@@ -2413,7 +3339,7 @@ async def newgame_date_manual(message: Message, state: FSMContext):
         return
 
     today = get_moscow_today()
-    max_date = today + timedelta(days=MAX_MATCH_DAYS_AHEAD)
+    max_date = today + _MAX_AHEAD
 
     if match_date_obj < today:
         await message.answer(
@@ -2460,13 +3386,14 @@ async def newgame_date_manual(message: Message, state: FSMContext):
 
 
 
-@dp.callback_query(F.data.startswith("newgame_time:"))
-async def newgame_time_choice(callback: CallbackQuery, state: FSMContext):
+@dp.callback_query(NewGameTimeCb.filter())
+async def newgame_time_choice(
+    callback: CallbackQuery, callback_data: NewGameTimeCb, state: FSMContext
+):
     """Выбор времени начала матча кнопками с шагом 30 минут."""
-    time_str = callback.data.split("newgame_time:", 1)[1]
+    time_str = f"{callback_data.hhmm[:2]}:{callback_data.hhmm[2:]}"
 
-    await state.update_data(match_time=time_str)
-    await state.set_state(NewGame.end_time)
+    await advance_state(state, NewGame.end_time, match_time=time_str)
 
     await callback.message.answer(f"Время начала матча: {time_str}")
     await callback.message.answer(
@@ -2485,9 +3412,7 @@ async def newgame_time(message: Message, state: FSMContext):
         )
         return
 
-    await state.update_data(match_time=time_str)
-
-    await state.set_state(NewGame.end_time)
+    await advance_state(state, NewGame.end_time, match_time=time_str)
     await message.answer(f"Время начала матча: {time_str}")
     await message.answer(
         "Теперь укажи время окончания матча в формате ЧЧ:ММ.\n"
@@ -2497,16 +3422,12 @@ async def newgame_time(message: Message, state: FSMContext):
 
 
 
-@dp.callback_query(F.data.startswith("duration:"))
-async def newgame_duration_choice(callback: CallbackQuery, state: FSMContext):
+@dp.callback_query(DurationCb.filter())
+async def newgame_duration_choice(
+    callback: CallbackQuery, callback_data: DurationCb, state: FSMContext
+):
     """Выбор продолжительности матча после выбора времени начала."""
-    data = callback.data or ""
-    try:
-        _, minutes_str = data.split("duration:", 1)
-        duration_minutes = int(minutes_str)
-    except Exception:
-        await callback.answer("Не удалось распознать продолжительность.", show_alert=True)
-        return
+    duration_minutes = callback_data.minutes
 
     fsm = await state.get_data()
     start_time_str = fsm.get("match_time")
@@ -2515,29 +3436,23 @@ async def newgame_duration_choice(callback: CallbackQuery, state: FSMContext):
         return
 
     try:
-        sh, sm = map(int, start_time_str.split(":"))
-    except Exception:
+        start_total = hhmm_to_minutes(start_time_str)
+    except ValueError:
         await callback.answer("Время начала указано в неверном формате.", show_alert=True)
         return
 
-    start_total = sh * 60 + sm
     end_total = start_total + duration_minutes
     end_h = (end_total // 60) % 24
     end_m = end_total % 60
     end_time_str = f"{end_h:02d}:{end_m:02d}"
 
     # Человеческое представление длительности
-    hours = duration_minutes // 60
-    mins = duration_minutes % 60
-    if hours and mins:
-        duration_text = f"{hours} ч {mins} мин"
-    elif hours:
-        duration_text = f"{hours} ч"
-    else:
-        duration_text = f"{mins} мин"
+    duration_text = format_duration(duration_minutes)
 
-    await state.update_data(match_end_time=end_time_str, duration_minutes=duration_minutes)
-    await state.set_state(NewGame.payment_type)
+    await advance_state(
+        state, NewGame.payment_type, fsm,
+        match_end_time=end_time_str, duration_minutes=duration_minutes,
+    )
 
     await callback.message.answer(
         f"Время матча: {start_time_str}–{end_time_str}\n"
@@ -2568,10 +3483,8 @@ async def newgame_end_time(message: Message, state: FSMContext):
     duration_minutes = None
     if start_time_str:
         try:
-            sh, sm = map(int, start_time_str.split(":"))
-            eh, em = map(int, end_time_str.split(":"))
-            start_minutes = sh * 60 + sm
-            end_minutes = eh * 60 + em
+            start_minutes = hhmm_to_minutes(start_time_str)
+            end_minutes = hhmm_to_minutes(end_time_str)
             if end_minutes <= start_minutes:
                 await message.answer(
                     "Время окончания матча должно быть позже времени начала.\n"
@@ -2585,20 +3498,14 @@ async def newgame_end_time(message: Message, state: FSMContext):
 
     # Человеческое представление длительности, если можем посчитать
     if duration_minutes is not None:
-        hours = duration_minutes // 60
-        mins = duration_minutes % 60
-        if hours and mins:
-            duration_text = f"{hours} ч {mins} мин"
-        elif hours:
-            duration_text = f"{hours} ч"
-        else:
-            duration_text = f"{mins} мин"
+        duration_text = format_duration(duration_minutes)
     else:
         duration_text = "не указана"
 
-    await state.update_data(match_end_time=end_time_str, duration_minutes=duration_minutes)
-
-    await state.set_state(NewGame.payment_type)
+    await advance_state(
+        state, NewGame.payment_type, data,
+        match_end_time=end_time_str, duration_minutes=duration_minutes,
+    )
     await message.answer(
         f"Время матча: {start_time_str}–{end_time_str}\n"
         f"Длительность: {duration_text}",
@@ -2615,25 +3522,18 @@ async def newgame_payment_type(message: Message, state: FSMContext):
 
     if text == "Отмена":
         await state.clear()
-        await message.answer("Создание игры отменено.", reply_markup=ReplyKeyboardRemove())
+        await message.answer("Создание игры отменено.", reply_markup=remove_kb)
         return
 
-    if text == "Делим поровну между всеми игроками":
-        payment_type = "split"
-    elif text == "Плачу я (организатор)":
-        payment_type = "creator"
-    elif text == "Обсудим в чате":
-        payment_type = "discuss"
-    else:
+    payment_type = PAYMENT_TYPE_BY_TEXT.get(text)
+    if payment_type is None:
         await message.answer(
             "Пожалуйста, выбери один из вариантов на клавиатуре 🙂",
             reply_markup=payment_type_kb,
         )
         return
 
-    await state.update_data(payment_type=payment_type)
-
-    await state.set_state(NewGame.game_type)
+    await advance_state(state, NewGame.game_type, payment_type=payment_type)
     await message.answer(
         "Выбери тип матча:",
         reply_markup=game_type_kb,
@@ -2644,16 +3544,14 @@ async def newgame_payment_type(message: Message, state: FSMContext):
 async def newgame_game_type(message: Message, state: FSMContext):
     text = (message.text or "").strip()
 
-    if text not in ["Тренировка", "Матч на рейтинг"]:
+    if text not in GAME_TYPES:
         await message.answer(
             "Пожалуйста, выбери один из вариантов: Тренировка или Матч на рейтинг 🙂",
             reply_markup=game_type_kb,
         )
         return
 
-    await state.update_data(game_type=text)
-
-    await state.set_state(NewGame.rating_limit_choice)
+    await advance_state(state, NewGame.rating_limit_choice, game_type=text)
     await message.answer(
         "Нужно ли ограничение по рейтингу?\n\n"
         "Если да — дальше выберешь диапазон.\n"
@@ -2667,8 +3565,7 @@ async def newgame_rating_limit_choice(message: Message, state: FSMContext):
     text = (message.text or "").strip()
 
     if text == "Без ограничений":
-        await state.update_data(rating_min=None, rating_max=None)
-        await state.set_state(NewGame.players_count)
+        await advance_state(state, NewGame.players_count, rating_min=None, rating_max=None)
         await message.answer(
             "Сколько игроков планируется?",
             reply_markup=players_count_kb,
@@ -2700,9 +3597,7 @@ async def newgame_rating_min(message: Message, state: FSMContext):
         )
         return
 
-    await state.update_data(rating_min=val)
-
-    await state.set_state(NewGame.rating_max)
+    await advance_state(state, NewGame.rating_max, rating_min=val)
     await message.answer(
         f"Минимальный рейтинг: {val:.1f}\n"
         "Теперь выбери максимальный рейтинг (не ниже минимального):",
@@ -2732,9 +3627,7 @@ async def newgame_rating_max(message: Message, state: FSMContext):
         )
         return
 
-    await state.update_data(rating_max=val)
-
-    await state.set_state(NewGame.players_count)
+    await advance_state(state, NewGame.players_count, data, rating_max=val)
     await message.answer(
         "Сколько игроков планируется?",
         reply_markup=players_count_kb,
@@ -2744,20 +3637,15 @@ async def newgame_rating_max(message: Message, state: FSMContext):
 @dp.message(NewGame.players_count)
 async def newgame_players_count(message: Message, state: FSMContext):
     text = (message.text or "").strip()
-    if text == "2 игрока":
-        cnt = 2
-    elif text == "4 игрока":
-        cnt = 4
-    else:
+    cnt = PLAYERS_COUNT_BY_TEXT.get(text)
+    if cnt is None:
         await message.answer(
             "Пожалуйста, выбери 2 игрока или 4 игрока 🙂",
             reply_markup=players_count_kb,
         )
         return
 
-    await state.update_data(players_count=cnt)
-
-    await state.set_state(NewGame.court_booking)
+    await advance_state(state, NewGame.court_booking, players_count=cnt)
     await message.answer(
         "Корт на это время уже забронирован?",
         reply_markup=court_booking_kb,
@@ -2768,11 +3656,8 @@ async def newgame_players_count(message: Message, state: FSMContext):
 async def newgame_court_booking(message: Message, state: FSMContext):
     text = (message.text or "").strip()
 
-    if text == "Корт уже забронирован":
-        booked = True
-    elif text == "Корт пока не забронирован":
-        booked = False
-    else:
+    booked = COURT_BOOKED_BY_TEXT.get(text)
+    if booked is None:
         await message.answer(
             "Пожалуйста, выбери один из вариантов:\n"
             "«Корт уже забронирован» или «Корт пока не забронирован».",
@@ -2780,9 +3665,7 @@ async def newgame_court_booking(message: Message, state: FSMContext):
         )
         return
 
-    await state.update_data(is_court_booked=booked)
-
-    await state.set_state(NewGame.privacy)
+    await advance_state(state, NewGame.privacy, is_court_booked=booked)
     await message.answer(
         "Укажи приватность матча:\n\n"
         "• Публичный матч — будет виден в общем списке игр.\n"
@@ -2795,34 +3678,26 @@ async def newgame_court_booking(message: Message, state: FSMContext):
 async def newgame_privacy(message: Message, state: FSMContext):
     text = (message.text or "").strip()
 
-    if text == "Публичный матч":
-        visibility = "public"
-    elif text == "Приватный матч":
-        visibility = "private"
-    else:
+    visibility = VISIBILITY_BY_TEXT.get(text)
+    if visibility is None:
         await message.answer(
             "Пожалуйста, выбери «Публичный матч» или «Приватный матч».",
             reply_markup=privacy_kb,
         )
         return
 
-    await state.update_data(visibility=visibility)
-
-    await state.set_state(NewGame.comment)
+    await advance_state(state, NewGame.comment, visibility=visibility)
     await message.answer(
         "Добавь комментарий к игре (например, сумму к оплате с каждого игрока или другие детали).\n"
         "Если ничего не хочешь добавлять — отправь «Пропустить».",
-        reply_markup=ReplyKeyboardMarkup(
-            keyboard=[[KeyboardButton(text="Пропустить")]],
-            resize_keyboard=True,
-        ),
+        reply_markup=skip_comment_kb,
     )
 
 
 @dp.message(NewGame.comment)
 async def newgame_comment(message: Message, state: FSMContext):
     text = (message.text or "").strip()
-    if text.lower().startswith("пропус"):
+    if is_skip_answer(text):
         comment = None
     else:
         comment = text
@@ -2865,35 +3740,22 @@ async def newgame_comment(message: Message, state: FSMContext):
 
     court_row = await get_court_by_id(court_id)
     if court_row:
-        addr = court_row["address"] or "Адрес не указан"
+        addr = court_row.address or "Адрес не указан"
     else:
         addr = "Адрес не указан"
 
-    if rating_min is not None and rating_max is not None:
-        rating_text = f"{rating_min:.2f}-{rating_max:.2f}"
-    else:
-        rating_text = "Без ограничений"
+    rating_text = format_rating_limit(rating_min, rating_max)
 
     booking_text = "забронирован" if is_court_booked else "не забронирован"
     privacy_text = "приватный матч" if visibility == "private" else "публичный матч"
 
-    if payment_type == "split":
-        payment_text = "делим поровну между всеми игроками"
-    elif payment_type == "creator":
-        payment_text = "организатор оплачивает корт"
-    elif payment_type == "discuss":
-        payment_text = "обсудим оплату в чате"
-    else:
-        payment_text = "не указано"
+    payment_text = PAYMENT_TEXT.get(payment_type, "не указано")
 
     comment_text = comment if comment else "—"
-    occupied, total = await get_game_occupancy(game_id)
+    # Матч только что создан, принятых заявок ещё нет — в БД не ходим
+    occupied, total = occupied_seats(creator_mode, 0), players_count
 
-    time_line = (
-        f"Время: {match_time}–{match_end_time}\n"
-        if match_end_time
-        else f"Время: {match_time}\n"
-    )
+    time_line = format_time_line(match_time, match_end_time)
 
     txt = (
         "Матч создан ✅\n\n"
@@ -2910,7 +3772,7 @@ async def newgame_comment(message: Message, state: FSMContext):
         f"Комментарий: {comment_text}"
     )
 
-    await message.answer(txt, parse_mode="HTML", reply_markup=ReplyKeyboardRemove())
+    await message.answer(txt, parse_mode="HTML", reply_markup=remove_kb)
 
 # -----------------------------------------
 # Просмотр матчей: /games
@@ -2918,8 +3780,7 @@ async def newgame_comment(message: Message, state: FSMContext):
 
 @dp.message(F.text == "/games")
 async def games_cmd(message: Message, state: FSMContext):
-    await update_username_only(message.from_user.id, message.from_user.username)
-    user = await get_user(message.from_user.id)
+    user = await upsert_username_and_get(message.from_user.id, message.from_user.username)
     if not user:
         await message.answer(
             "Сначала нужно заполнить профиль.\n"
@@ -2947,7 +3808,7 @@ async def games_date_choice(message: Message, state: FSMContext):
         await state.clear()
         await message.answer(
             "Просмотр матчей отменён.",
-            reply_markup=ReplyKeyboardRemove(),
+            reply_markup=remove_kb,
         )
         return
 
@@ -2955,7 +3816,7 @@ async def games_date_choice(message: Message, state: FSMContext):
         d = today.strftime("%d.%m.%Y")
         await state.update_data(filter_date=d)
     elif text == "Завтра":
-        d = (today + timedelta(days=1)).strftime("%d.%m.%Y")
+        d = (today + _ONE_DAY).strftime("%d.%m.%Y")
         await state.update_data(filter_date=d)
     elif text == "Все даты":
         await state.update_data(filter_date=None)
@@ -2963,7 +3824,7 @@ async def games_date_choice(message: Message, state: FSMContext):
         await state.set_state(ViewGames.date_manual)
         await message.answer(
             "Введи дату в формате ДД.ММ.ГГГГ\nНапример: 25.11.2024",
-            reply_markup=ReplyKeyboardRemove(),
+            reply_markup=remove_kb,
         )
         return
     else:
@@ -2985,14 +3846,15 @@ async def games_date_choice(message: Message, state: FSMContext):
 async def games_date_manual(message: Message, state: FSMContext):
     text = (message.text or "").strip()
 
-    if not re.match(r"^\d{2}\.\d{2}\.\d{4}$", text):
+    m = _STRICT_DATE_RE.match(text)
+    if not m:
         await message.answer(
             "Не похоже на дату 😅\nНужен формат ДД.ММ.ГГГГ, например: 25.11.2024",
         )
         return
 
     try:
-        day, month, year = map(int, text.split("."))
+        day, month, year = map(int, m.groups())
         date(year, month, day)
     except ValueError:
         await message.answer(
@@ -3017,7 +3879,7 @@ async def games_time_choice(message: Message, state: FSMContext):
         await state.clear()
         await message.answer(
             "Просмотр матчей отменён.",
-            reply_markup=ReplyKeyboardRemove(),
+            reply_markup=remove_kb,
         )
         return
 
@@ -3032,22 +3894,13 @@ async def games_time_choice(message: Message, state: FSMContext):
         )
         return
 
-    if text == "Без фильтра по времени":
-        await state.update_data(filter_time_from=None)
-    elif text == "Утро":
-        await state.update_data(filter_time_from="morning")
-    elif text == "День":
-        await state.update_data(filter_time_from="day")
-    elif text == "Вечер":
-        await state.update_data(filter_time_from="evening")
-    elif text == "Ночь":
-        await state.update_data(filter_time_from="night")
-    else:
+    if text not in TIME_FILTER_BY_TEXT:
         await message.answer(
             "Пожалуйста, выбери вариант на клавиатуре.",
             reply_markup=games_time_choice_kb,
         )
         return
+    await state.update_data(filter_time_from=TIME_FILTER_BY_TEXT[text])
 
     await state.set_state(ViewGames.home_courts_filter)
     await message.answer(
@@ -3078,12 +3931,55 @@ async def games_time_manual(message: Message, state: FSMContext):
     )
 
 
+# Кнопки карточек матча. Разметка зависит только от id матча и пары флагов,
+# поэтому повторный показ той же карточки не собирает pydantic-модели заново
+# (типы aiogram неизменяемые — один объект можно отдавать многократно).
+def _game_btn(text: str, callback_data: str) -> List[InlineKeyboardButton]:
+    return [InlineKeyboardButton(text=text, callback_data=callback_data)]
+
+
+@lru_cache(maxsize=1024)
+def listing_game_kb(game_id: int, is_creator: bool, can_invite: bool) -> InlineKeyboardMarkup:
+    """Карточка в /games: свой матч — пригласить/отменить, чужой — подать заявку."""
+    buttons = [_game_btn("👥 Просмотреть участников", f"view_participants:{game_id}")]
+    if is_creator:
+        if can_invite:
+            buttons.append(_game_btn("📨 Пригласить участников", f"invite_players:{game_id}:0"))
+        buttons.append(_game_btn("❌ Отменить матч", f"cancel_game:{game_id}"))
+    else:
+        buttons.append(_game_btn("Подать заявку на матч", f"apply_game:{game_id}"))
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+
+@lru_cache(maxsize=1024)
+def scheduled_game_kb(game_id: int, can_invite: bool) -> InlineKeyboardMarkup:
+    """Свой запланированный матч: отклики, приглашения (если есть места), участники, отмена."""
+    buttons = [_game_btn("👀 Просмотреть отклики", f"view_apps:{game_id}")]
+    if can_invite:
+        buttons.append(_game_btn("📨 Пригласить участников", f"invite_players:{game_id}:0"))
+    buttons.append(_game_btn("👥 Просмотреть участников", f"view_participants:{game_id}"))
+    buttons.append(_game_btn("❌ Отменить матч", f"cancel_game:{game_id}"))
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+
+@lru_cache(maxsize=1024)
+def set_score_kb(game_id: int) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[_game_btn("Внести счёт", f"set_score:{game_id}")])
+
+
+@lru_cache(maxsize=1024)
+def participants_kb(game_id: int) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(
+        inline_keyboard=[_game_btn("👥 Просмотреть участников", f"view_participants:{game_id}")]
+    )
+
+
 async def _send_games_page(message: Message, state: FSMContext, initial: bool = False):
     data = await state.get_data()
     filter_date = data.get("filter_date")
     filter_time_from = data.get("filter_time_from")
     only_home = data.get("only_home", False)
-    offset = data.get("offset", 0)
+    after = data.get("after")
 
     games = await get_games_for_listing(
         user_id=message.from_user.id,
@@ -3091,13 +3987,13 @@ async def _send_games_page(message: Message, state: FSMContext, initial: bool =
         filter_time_from=filter_time_from,
         only_home=only_home,
         limit=GAMES_PAGE_SIZE,
-        offset=offset,
+        after=after,
     )
 
     if initial and not games:
         await message.answer(
             "По выбранным фильтрам пока нет доступных матчей 😔",
-            reply_markup=ReplyKeyboardRemove(),
+            reply_markup=remove_kb,
         )
         await state.clear()
         return
@@ -3105,125 +4001,36 @@ async def _send_games_page(message: Message, state: FSMContext, initial: bool =
     if not games:
         await message.answer(
             "Больше матчей по этим фильтрам нет.",
-            reply_markup=ReplyKeyboardRemove(),
+            reply_markup=remove_kb,
         )
         await state.clear()
         return
 
     for g in games:
-        if g["rating_min"] is not None and g["rating_max"] is not None:
-            rating_text = f"{g['rating_min']:.2f}-{g['rating_max']:.2f}"
-        else:
-            rating_text = "Без ограничений"
-
-        booking_text = "забронирован" if g["is_court_booked"] else "не забронирован"
-        comment_text = g["comment"] if g["comment"] else "—"
-
-        payment_type = g["payment_type"]
-        if payment_type == "split":
-            payment_text = "делим поровну между всеми игроками"
-        elif payment_type == "creator":
-            payment_text = "организатор оплачивает корт"
-        elif payment_type == "discuss":
-            payment_text = "обсудим оплату в чате"
-        else:
-            payment_text = "не указано"
-
-        creator_name = g["creator_name"] or "Игрок"
-        creator_ntrp = g["creator_ntrp"]
-        if creator_ntrp is not None:
-            creator_line = f"{creator_name} (NTRP {creator_ntrp:.2f})"
-        else:
-            creator_line = creator_name
-
-        addr = g["court_address"] or "Адрес не указан"
-        occupied, total = await get_game_occupancy(g["id"])
-
-        duration_minutes = g['duration_minutes']
-        if duration_minutes:
-            hours = duration_minutes // 60
-            mins = duration_minutes % 60
-            if hours and mins:
-                duration_text = f"{hours} ч {mins} мин"
-            elif hours:
-                duration_text = f"{hours} ч"
-            else:
-                duration_text = f"{mins} мин"
-            time_line = (
-                f"Время: {g['match_time']}–{g['match_end_time']} ({duration_text})\n"
-                if g['match_end_time']
-                else f"Время: {g['match_time']} ({duration_text})\n"
-            )
-        else:
-            time_line = (
-                f"Время: {g['match_time']}–{g['match_end_time']}\n"
-                if g['match_end_time']
-                else f"Время: {g['match_time']}\n"
-            )
+        occupied, total = game_occupancy(g)
 
         txt = (
             f"🎾 <b>Матч #{g['id']}</b>\n\n"
-            f"Организатор: {creator_line}\n"
+            f"Организатор: {format_creator_line(g)}\n"
             f"Тип: {g['game_type']}\n"
             f"Дата: {g['match_date']}\n"
-            f"{time_line}"
-            f"Корт: {g['court_short_name']} — <i>📍 {addr}</i>\n"
-            f"Игроки: {occupied} из {total}\n"
-            f"Ограничение по рейтингу: {rating_text}\n"
-            f"Бронь корта: {booking_text}\n"
-            f"Оплата: {payment_text}\n"
-            f"Комментарий: {comment_text}"
+            + format_game_card_body(g, occupied, total)
         )
 
-        is_creator = g["creator_id"] == message.from_user.id
-
-        buttons = [
-            [
-                InlineKeyboardButton(
-                    text="👥 Просмотреть участников",
-                    callback_data=f"view_participants:{g['id']}",
-                )
-            ]
-        ]
-
-        if is_creator:
-            # Мой предстоящий матч: можно приглашать и отменять
-            if occupied < total:
-                buttons.append(
-                    [
-                        InlineKeyboardButton(
-                            text="📨 Пригласить участников",
-                            callback_data=f"invite_players:{g['id']}:0",
-                        )
-                    ]
-                )
-
-            buttons.append(
-                [
-                    InlineKeyboardButton(
-                        text="❌ Отменить матч",
-                        callback_data=f"cancel_game:{g['id']}",
-                    )
-                ]
-            )
-        else:
-            # Чужой предстоящий матч: можно подать заявку
-            buttons.append(
-                [
-                    InlineKeyboardButton(
-                        text="Подать заявку на матч",
-                        callback_data=f"apply_game:{g['id']}",
-                    )
-                ]
-            )
-
-        kb = InlineKeyboardMarkup(inline_keyboard=buttons)
+        kb = listing_game_kb(
+            g["id"],
+            is_creator=g["creator_id"] == message.from_user.id,
+            can_invite=occupied < total,
+        )
 
         await message.answer(txt, parse_mode="HTML", reply_markup=kb)
 
     # Если выдано ровно PAGE_SIZE — предложим показать ещё
     if len(games) == GAMES_PAGE_SIZE:
-        await state.update_data(offset=offset + GAMES_PAGE_SIZE)
+        last = games[-1]
+        await patch_state(
+            state, data, after=[last["match_date"], last["match_time"], last["id"]]
+        )
         await message.answer(
             "Показать ещё матчи?",
             reply_markup=games_browse_kb,
@@ -3232,7 +4039,7 @@ async def _send_games_page(message: Message, state: FSMContext, initial: bool =
     else:
         await message.answer(
             "Это все матчи по выбранным фильтрам.",
-            reply_markup=ReplyKeyboardRemove(),
+            reply_markup=remove_kb,
         )
         await state.clear()
 
@@ -3245,7 +4052,7 @@ async def games_home_filter(message: Message, state: FSMContext):
         await state.clear()
         await message.answer(
             "Просмотр матчей отменён.",
-            reply_markup=ReplyKeyboardRemove(),
+            reply_markup=remove_kb,
         )
         return
 
@@ -3270,7 +4077,7 @@ async def games_home_filter(message: Message, state: FSMContext):
         )
         return
 
-    await state.update_data(only_home=only_home, offset=0)
+    await state.update_data(only_home=only_home, after=None)
 
     # Показываем первую страницу
     await _send_games_page(message, state, initial=True)
@@ -3288,7 +4095,7 @@ async def games_browsing(message: Message, state: FSMContext):
         await state.clear()
         await message.answer(
             "Просмотр матчей завершён.",
-            reply_markup=ReplyKeyboardRemove(),
+            reply_markup=remove_kb,
         )
         return
 
@@ -3296,90 +4103,37 @@ async def games_browsing(message: Message, state: FSMContext):
     await state.clear()
     await message.answer(
         "Просмотр матчей остановлен.",
-        reply_markup=ReplyKeyboardRemove(),
+        reply_markup=remove_kb,
     )
 
 # -----------------------------------------
 # Мои матчи: /mygames
 # -----------------------------------------
 
-async def _send_created_games_list(message: Message, user_id: int, status: Optional[str]):
+async def _send_created_games_list(message: Message, user_id: int, status: Optional[str]) -> bool:
     """
     Список матчей пользователя по статусу.
     status может быть: "scheduled", "finished", "cancelled" или None (все матчи).
+    Если матчей нет — одним сообщением отвечаем и заново показываем меню
+    раздела; тогда возвращаем False, и меню отдельно слать не нужно.
     """
     games = await get_games_created_by_user(user_id, status=status)
     if not games:
-        if status == "scheduled":
-            await message.answer("У тебя пока нет предстоящих матчей.")
-        elif status == "finished":
-            await message.answer("У тебя пока нет завершённых матчей.")
-        elif status == "cancelled":
-            await message.answer("У тебя пока нет отменённых матчей.")
-        else:
-            await message.answer("У тебя пока нет матчей.")
-        return
-
+        await message.answer(
+            f"{MY_GAMES_EMPTY_TEXT[status]}\n\n{MY_GAMES_MENU_TEXT}",
+            reply_markup=my_games_main_kb,
+        )
+        return False
 
     for g in games:
-        if g["rating_min"] is not None and g["rating_max"] is not None:
-            rating_text = f"{g['rating_min']:.2f}-{g['rating_max']:.2f}"
-        else:
-            rating_text = "Без ограничений"
-
-        booking_text = "забронирован" if g["is_court_booked"] else "не забронирован"
-        comment_text = g["comment"] if g["comment"] else "—"
-        addr = g["court_address"] or "Адрес не указан"
-        occupied, total = await get_game_occupancy(g["id"])
-        score_text = g["score"] or "—"
-
-        payment_type = g["payment_type"]
-        if payment_type == "split":
-            payment_text = "делим поровну между всеми игроками"
-        elif payment_type == "creator":
-            payment_text = "организатор оплачивает корт"
-        elif payment_type == "discuss":
-            payment_text = "обсудим оплату в чате"
-        else:
-            payment_text = "не указано"
-
-
-        duration_minutes = g['duration_minutes']
-        if duration_minutes:
-            hours = duration_minutes // 60
-            mins = duration_minutes % 60
-            if hours and mins:
-                duration_text = f"{hours} ч {mins} мин"
-            elif hours:
-                duration_text = f"{hours} ч"
-            else:
-                duration_text = f"{mins} мин"
-        else:
-            duration_text = None
-
-        if g['match_end_time']:
-            if duration_text:
-                time_line = f"Время: {g['match_time']}–{g['match_end_time']} ({duration_text})\n"
-            else:
-                time_line = f"Время: {g['match_time']}–{g['match_end_time']}\n"
-        else:
-            if duration_text:
-                time_line = f"Время: {g['match_time']} ({duration_text})\n"
-            else:
-                time_line = f"Время: {g['match_time']}\n"
+        occupied, total = game_occupancy(g)
 
         txt = (
             f"🎾 <b>Матч #{g['id']}</b>\n\n"
             f"Статус: {'запланирован' if g['status']=='scheduled' else 'завершён' if g['status']=='finished' else 'отменён'}\n"
             f"Дата: {g['match_date']}\n"
-            f"{time_line}"
-            f"Корт: {g['court_short_name']} — <i>📍 {addr}</i>\n"
-            f"Игроки: {occupied} из {total}\n"
-            f"Ограничение по рейтингу: {rating_text}\n"
-            f"Бронь корта: {booking_text}\n"
-            f"Оплата: {payment_text}\n"
-            f"Комментарий: {comment_text}\n"
-            f"Счёт: {score_text}"
+            + format_game_card_body(g, occupied, total)
+            + f"\nСчёт: {g['score'] or '—'}"
         )
 
         # Кнопки зависят от фактического статуса матча, а не от фильтра,
@@ -3387,64 +4141,15 @@ async def _send_created_games_list(message: Message, user_id: int, status: Optio
         if g["status"] == "scheduled":
             # Запланированный матч — можно смотреть отклики, участников и отменять.
             # Кнопка «Пригласить участников» показывается только если матч ещё не укомплектован.
-            buttons = [
-                [
-                    InlineKeyboardButton(
-                        text="👀 Просмотреть отклики",
-                        callback_data=f"view_apps:{g['id']}",
-                    )
-                ]
-            ]
-
-            # Добавляем кнопку приглашения только если есть свободные места
-            if occupied < total:
-                buttons.append(
-                    [
-                        InlineKeyboardButton(
-                            text="📨 Пригласить участников",
-                            callback_data=f"invite_players:{g['id']}:0",
-                        )
-                    ]
-                )
-
-            # Кнопка просмотра участников
-            buttons.append(
-                [
-                    InlineKeyboardButton(
-                        text="👥 Просмотреть участников",
-                        callback_data=f"view_participants:{g['id']}",
-                    )
-                ]
-            )
-
-            # Кнопка отмены матча
-            buttons.append(
-                [
-                    InlineKeyboardButton(
-                        text="❌ Отменить матч",
-                        callback_data=f"cancel_game:{g['id']}",
-                    )
-                ]
-            )
-
-            kb = InlineKeyboardMarkup(inline_keyboard=buttons)
+            kb = scheduled_game_kb(g["id"], can_invite=occupied < total)
             await message.answer(txt, parse_mode="HTML", reply_markup=kb)
         elif g["status"] == "finished" and not g["score"]:
             # Завершённый матч без счёта — предлагаем внести счёт
-            kb = InlineKeyboardMarkup(
-                inline_keyboard=[
-                    [
-                        InlineKeyboardButton(
-                            text="Внести счёт",
-                            callback_data=f"set_score:{g['id']}",
-                        )
-                    ]
-                ]
-            )
-            await message.answer(txt, parse_mode="HTML", reply_markup=kb)
+            await message.answer(txt, parse_mode="HTML", reply_markup=set_score_kb(g["id"]))
         else:
             # Для остальных случаев (есть счёт, матч отменён и т.п.) — без доп. кнопок
             await message.answer(txt, parse_mode="HTML")
+    return True
 
 
 async def _send_my_participating_games(message: Message, user_id: int):
@@ -3461,35 +4166,7 @@ async def _send_my_participating_games(message: Message, user_id: int):
         return
 
     for g in games:
-        # Ограничение по рейтингу
-        if g["rating_min"] is not None and g["rating_max"] is not None:
-            rating_text = f"{g['rating_min']:.2f}-{g['rating_max']:.2f}"
-        else:
-            rating_text = "Без ограничений"
-
-        booking_text = "забронирован" if g["is_court_booked"] else "не забронирован"
-        comment_text = g["comment"] if g["comment"] else "—"
-
-        payment_type = g["payment_type"]
-        if payment_type == "split":
-            payment_text = "делим поровну между всеми игроками"
-        elif payment_type == "creator":
-            payment_text = "организатор оплачивает корт"
-        elif payment_type == "discuss":
-            payment_text = "обсудим оплату в чате"
-        else:
-            payment_text = "не указано"
-
-        addr = g["court_address"] or "Адрес не указан"
-        occupied, total = await get_game_occupancy(g["id"])
-        score_text = g["score"] or "—"
-
-        creator_name = g["creator_name"] or "Игрок"
-        creator_ntrp = g["creator_ntrp"]
-        if creator_ntrp is not None:
-            creator_line = f"{creator_name} (NTRP {creator_ntrp:.2f})"
-        else:
-            creator_line = creator_name
+        occupied, total = game_occupancy(g)
 
         is_creator = g["creator_id"] == user_id
         if is_creator:
@@ -3497,65 +4174,22 @@ async def _send_my_participating_games(message: Message, user_id: int):
         else:
             participation_line = "Твоё участие: заявка принята ✅"
 
-        duration_minutes = g['duration_minutes']
-        if duration_minutes:
-            hours = duration_minutes // 60
-            mins = duration_minutes % 60
-            if hours and mins:
-                duration_text = f"{hours} ч {mins} мин"
-            elif hours:
-                duration_text = f"{hours} ч"
-            else:
-                duration_text = f"{mins} мин"
-        else:
-            duration_text = None
-
-        if g['match_end_time']:
-            if duration_text:
-                time_line = f"Время: {g['match_time']}–{g['match_end_time']} ({duration_text})\n"
-            else:
-                time_line = f"Время: {g['match_time']}–{g['match_end_time']}\n"
-        else:
-            if duration_text:
-                time_line = f"Время: {g['match_time']} ({duration_text})\n"
-            else:
-                time_line = f"Время: {g['match_time']}\n"
-
-
         txt = (
             f"🎾 <b>Матч #{g['id']}</b>\n\n"
             f"{participation_line}\n"
-            f"Организатор: {creator_line}\n"
+            f"Организатор: {format_creator_line(g)}\n"
             f"Статус матча: {g['status']}\n"
             f"Дата: {g['match_date']}\n"
-            f"{time_line}"
-            f"Корт: {g['court_short_name']} — <i>📍 {addr}</i>\n"
-            f"Игроки: {occupied} из {total}\n"
-            f"Ограничение по рейтингу: {rating_text}\n"
-            f"Бронь корта: {booking_text}\n"
-            f"Оплата: {payment_text}\n"
-            f"Комментарий: {comment_text}\n"
-            f"Счёт: {score_text}"
-        )
-
-        kb = InlineKeyboardMarkup(
-            inline_keyboard=[
-                [
-                    InlineKeyboardButton(
-                        text="👥 Просмотреть участников",
-                        callback_data=f"view_participants:{g['id']}",
-                    )
-                ]
-            ]
+            + format_game_card_body(g, occupied, total)
+            + f"\nСчёт: {g['score'] or '—'}"
         )
 
-        await message.answer(txt, parse_mode="HTML", reply_markup=kb)
+        await message.answer(txt, parse_mode="HTML", reply_markup=participants_kb(g["id"]))
 
 
 @dp.message(F.text == "/mygames")
 async def mygames_cmd(message: Message, state: FSMContext):
-    await update_username_only(message.from_user.id, message.from_user.username)
-    user = await get_user(message.from_user.id)
+    user = await upsert_username_and_get(message.from_user.id, message.from_user.username)
     if not user:
         await message.answer(
             "Сначала нужно заполнить профиль.\n"
@@ -3565,47 +4199,22 @@ async def mygames_cmd(message: Message, state: FSMContext):
 
     await state.clear()
     await state.set_state(MyGames.main)
-    await message.answer(
-        "Раздел «Мои матчи».\n"
-        "Выбери, что показать:",
-        reply_markup=my_games_main_kb,
-    )
+    await message.answer(MY_GAMES_MENU_TEXT, reply_markup=my_games_main_kb)
 
 
 @dp.message(MyGames.main)
 async def mygames_main_handler(message: Message, state: FSMContext):
     text = (message.text or "").strip()
 
-    if text == "Предстоящие матчи":
-        await _send_created_games_list(message, message.from_user.id, status="scheduled")
-        await message.answer(
-            "Раздел «Мои матчи».\nВыбери, что показать:",
-            reply_markup=my_games_main_kb,
-        )
-    elif text == "Завершённые матчи":
-        await _send_created_games_list(message, message.from_user.id, status="finished")
-        await message.answer(
-            "Раздел «Мои матчи».\nВыбери, что показать:",
-            reply_markup=my_games_main_kb,
-        )
-    elif text == "Отменённые матчи":
-        await _send_created_games_list(message, message.from_user.id, status="cancelled")
-        await message.answer(
-            "Раздел «Мои матчи».\nВыбери, что показать:",
-            reply_markup=my_games_main_kb,
-        )
-    elif text == "Все мои матчи":
-        # Без фильтра по статусу — покажем все матчи пользователя
-        await _send_created_games_list(message, message.from_user.id, status=None)
-        await message.answer(
-            "Раздел «Мои матчи».\nВыбери, что показать:",
-            reply_markup=my_games_main_kb,
-        )
+    if text in MY_GAMES_STATUS_BY_TEXT:
+        status = MY_GAMES_STATUS_BY_TEXT[text]
+        if await _send_created_games_list(message, message.from_user.id, status=status):
+            await message.answer(MY_GAMES_MENU_TEXT, reply_markup=my_games_main_kb)
     elif text == "Назад":
         await state.clear()
         await message.answer(
             "Выход из раздела «Мои матчи».",
-            reply_markup=ReplyKeyboardRemove(),
+            reply_markup=remove_kb,
         )
     else:
         await message.answer(
@@ -3713,56 +4322,22 @@ async def apply_game_callback(callback: CallbackQuery):
         await callback.answer("Что-то пошло не так 😔", show_alert=False)
         return
 
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-
-        # Проверим, что матч существует и публичный
-        cursor = await db.execute(
-            "SELECT id, creator_id, visibility, is_active FROM games WHERE id = ?;",
-            (game_id,),
-        )
-        game = await cursor.fetchone()
-        await cursor.close()
-
-        if not game or game["is_active"] != 1 or game["visibility"] != "public":
-            await callback.answer("Этот матч недоступен для заявок.", show_alert=True)
-            return
-
-        if game["creator_id"] == callback.from_user.id:
-            await callback.answer("Это твой матч 🙂", show_alert=True)
-            return
+    outcome, application_id, creator_id = await apply_to_game(game_id, callback.from_user.id)
 
-        # Проверим, не подавал ли уже заявку
-        cursor = await db.execute(
-            """
-            SELECT id FROM game_applications
-            WHERE game_id = ? AND applicant_id = ?;
-            """,
-            (game_id, callback.from_user.id),
-        )
-        exists = await cursor.fetchone()
-        await cursor.close()
+    if outcome == APPLY_UNAVAILABLE:
+        await callback.answer("Этот матч недоступен для заявок.", show_alert=True)
+        return
 
-        if exists:
-            await callback.answer(
-                "Ты уже подавал заявку на этот матч.",
-                show_alert=True,
-            )
-            return
+    if outcome == APPLY_OWN_GAME:
+        await callback.answer("Это твой матч 🙂", show_alert=True)
+        return
 
-        # Создаём заявку
-        await db.execute(
-            """
-            INSERT INTO game_applications (game_id, applicant_id)
-            VALUES (?, ?);
-            """,
-            (game_id, callback.from_user.id),
+    if outcome == APPLY_EXISTS:
+        await callback.answer(
+            "Ты уже подавал заявку на этот матч.",
+            show_alert=True,
         )
-        cursor = await db.execute("SELECT last_insert_rowid();")
-        row = await cursor.fetchone()
-        await cursor.close()
-        application_id = row[0]
-        await db.commit()
+        return
 
     # Пытаемся получить профиль игрока
     applicant_user = await get_user(callback.from_user.id)
@@ -3770,7 +4345,7 @@ async def apply_game_callback(callback: CallbackQuery):
     # Показываем карточку игрока создателю матча
     try:
         await send_application_card_to_creator(
-            creator_chat_id=game["creator_id"],
+            creator_chat_id=creator_id,
             application_id=application_id,
             game_id=game_id,
             applicant_user=applicant_user,
@@ -3794,10 +4369,8 @@ async def app_decision_callback(callback: CallbackQuery):
         await callback.answer("Некорректные данные заявки.", show_alert=False)
         return
 
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-
-        cursor = await db.execute(
+    async with db() as conn:
+        cursor = await conn.execute(
             """
             SELECT ga.*, g.creator_id, g.id AS game_id
             FROM game_applications ga
@@ -3809,32 +4382,41 @@ async def app_decision_callback(callback: CallbackQuery):
         app_row = await cursor.fetchone()
         await cursor.close()
 
-        if not app_row:
-            await callback.answer("Заявка не найдена.", show_alert=True)
-            return
+    # Соединение возвращаем в пул до ответа в Telegram
+    if not app_row:
+        await callback.answer("Заявка не найдена.", show_alert=True)
+        return
 
-        creator_id = app_row["creator_id"]
-        game_id = app_row["game_id"]
-        applicant_id = app_row["applicant_id"]
-        status = app_row["status"]
+    creator_id = app_row["creator_id"]
+    game_id = app_row["game_id"]
+    applicant_id = app_row["applicant_id"]
+    status = app_row["status"]
 
-        if callback.from_user.id != creator_id:
-            await callback.answer("Вы не организатор этого матча.", show_alert=True)
-            return
+    if callback.from_user.id != creator_id:
+        await callback.answer("Вы не организатор этого матча.", show_alert=True)
+        return
 
-        if status != "pending":
-            await callback.answer(
-                f"Заявка уже обработана (статус: {status}).",
-                show_alert=True,
-            )
-            return
+    if status != "pending":
+        await callback.answer(
+            f"Заявка уже обработана (статус: {status}).",
+            show_alert=True,
+        )
+        return
 
-        new_status = "accepted" if action == "accept" else "rejected"
-        await db.execute(
-            "UPDATE game_applications SET status = ? WHERE id = ?;",
+    new_status = "accepted" if action == "accept" else "rejected"
+    async with db() as conn:
+        # status = 'pending' в условии — на случай двойного нажатия между SELECT и UPDATE
+        cursor = await conn.execute(
+            "UPDATE game_applications SET status = ? WHERE id = ? AND status = 'pending';",
             (new_status, application_id),
         )
-        await db.commit()
+        updated = cursor.rowcount
+        await cursor.close()
+        await conn.commit()
+
+    if not updated:
+        await callback.answer("Заявка уже обработана.", show_alert=True)
+        return
 
     # Если заявка отклонена — просто уведомляем игрока и организатора
     if new_status == "rejected":
@@ -3856,12 +4438,8 @@ async def app_decision_callback(callback: CallbackQuery):
     # Собираем список всех участников матча после принятия заявки
     participant_ids = await get_game_participant_ids(game_id, include_creator=True)
 
-    # Словарь профилей участников
-    users_by_id = {}
-    for pid in participant_ids:
-        u = await get_user(pid)
-        if u:
-            users_by_id[pid] = u
+    # Словарь профилей участников — одним запросом
+    users_by_id = await get_users_bulk(participant_ids)
 
     def format_contact(u) -> str:
         if not u:
@@ -3921,23 +4499,21 @@ async def app_decision_callback(callback: CallbackQuery):
     except Exception as e:
         logger.exception("Failed to notify applicant about accepted application: %s", e)
 
-    # 3) Сообщения остальным участникам матча
-    try:
-        new_player_user = users_by_id.get(applicant_id)
-        new_player_contact = format_contact(new_player_user)
-
-        for pid in participant_ids:
-            if pid == applicant_id or pid == creator_id:
-                # Этим двоим уже отправили отдельные сообщения
-                continue
-            contacts_for_other = build_contacts_for(pid)
-            await bot.send_message(
+    # 3) Сообщения остальным участникам матча — всем сразу, это разные чаты
+    new_player_contact = format_contact(users_by_id.get(applicant_id))
+    await send_to_chats(
+        [
+            (
                 pid,
                 f"К вашему матчу #{game_id} присоединился новый участник {new_player_contact} ✅\n\n"
-                f"Актуальный список участников (которым вы можете написать в Telegram):\n{contacts_for_other}",
+                f"Актуальный список участников (которым вы можете написать в Telegram):\n{build_contacts_for(pid)}",
             )
-    except Exception as e:
-        logger.exception("Failed to notify existing participants about new one: %s", e)
+            # Организатору и принятому игроку уже отправили отдельные сообщения
+            for pid in participant_ids
+            if pid != applicant_id and pid != creator_id
+        ],
+        "new participant notice",
+    )
 
     await callback.answer("Решение по заявке сохранено.", show_alert=False)
 
@@ -3953,33 +4529,34 @@ async def cancel_game_callback(callback: CallbackQuery):
         await callback.answer("Некорректный ID матча.", show_alert=False)
         return
 
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with db() as conn:
         # Проверяем, что создатель — текущий пользователь
-        cursor = await db.execute(
+        cursor = await conn.execute(
             "SELECT creator_id, status FROM games WHERE id = ?;",
             (game_id,),
         )
         row = await cursor.fetchone()
         await cursor.close()
 
-        if not row:
-            await callback.answer("Матч не найден.", show_alert=True)
-            return
+    if not row:
+        await callback.answer("Матч не найден.", show_alert=True)
+        return
 
-        if row["creator_id"] != callback.from_user.id:
-            await callback.answer("Ты не организатор этого матча.", show_alert=True)
-            return
+    if row["creator_id"] != callback.from_user.id:
+        await callback.answer("Ты не организатор этого матча.", show_alert=True)
+        return
 
-        if row["status"] == "cancelled":
-            await callback.answer("Матч уже отменён.", show_alert=True)
-            return
+    if row["status"] == "cancelled":
+        await callback.answer("Матч уже отменён.", show_alert=True)
+        return
 
-        await db.execute(
+    async with db() as conn:
+        await conn.execute(
             "UPDATE games SET status = 'cancelled', is_active = 0 WHERE id = ?;",
             (game_id,),
         )
         # Обновим статусы заявок
-        await db.execute(
+        await conn.execute(
             """
             UPDATE game_applications
             SET status = 'cancelled'
@@ -3987,7 +4564,7 @@ async def cancel_game_callback(callback: CallbackQuery):
             """,
             (game_id,),
         )
-        await db.commit()
+        await conn.commit()
 
     await callback.answer("Матч отменён.", show_alert=False)
     await callback.message.reply(f"Матч #{game_id} отменён ❌")
@@ -4005,26 +4582,25 @@ async def view_apps_callback(callback: CallbackQuery):
         await callback.answer("Некорректный ID матча.", show_alert=False)
         return
 
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-
+    async with db() as conn:
         # Проверяем, что юзер — создатель матча
-        cursor = await db.execute(
+        cursor = await conn.execute(
             "SELECT creator_id FROM games WHERE id = ?;",
             (game_id,),
         )
         game_row = await cursor.fetchone()
         await cursor.close()
 
-        if not game_row:
-            await callback.answer("Матч не найден.", show_alert=True)
-            return
+    if not game_row:
+        await callback.answer("Матч не найден.", show_alert=True)
+        return
 
-        if game_row["creator_id"] != callback.from_user.id:
-            await callback.answer("Ты не организатор этого матча.", show_alert=True)
-            return
+    if game_row["creator_id"] != callback.from_user.id:
+        await callback.answer("Ты не организатор этого матча.", show_alert=True)
+        return
 
-        cursor = await db.execute(
+    async with db() as conn:
+        cursor = await conn.execute(
             """
             SELECT ga.*, u.*
             FROM game_applications ga
@@ -4129,9 +4705,7 @@ async def invite_players_callback(callback: CallbackQuery):
 
     PAGE_SIZE = 10
 
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-
+    async with db() as conn:
         params = []
         sql = "SELECT * FROM users WHERE 1=1"
 
@@ -4152,7 +4726,7 @@ async def invite_players_callback(callback: CallbackQuery):
         sql += " ORDER BY telegram_id DESC LIMIT ? OFFSET ?"
         params.extend([PAGE_SIZE + 1, offset])
 
-        cursor = await db.execute(sql, params)
+        cursor = await conn.execute(sql, params)
         rows = await cursor.fetchall()
         await cursor.close()
 
@@ -4284,53 +4858,7 @@ async def send_invite_callback(callback: CallbackQuery):
 
     creator_line = _format_contact(creator_user)
 
-    # Ограничение по рейтингу
-    if game["rating_min"] is not None and game["rating_max"] is not None:
-        rating_text = f"{game['rating_min']:.2f}-{game['rating_max']:.2f}"
-    else:
-        rating_text = "Без ограничений"
-
-    # Бронь / оплата / комментарий
-    booking_text = "забронирован" if game["is_court_booked"] else "не забронирован"
-    comment_text = game["comment"] if game["comment"] else "—"
-    addr = game["court_address"] or "Адрес не указан"
     occupied, total = await get_game_occupancy(game_id)
-    score_text = game["score"] or "—"
-
-    payment_type = game["payment_type"]
-    if payment_type == "split":
-        payment_text = "делим поровну между всеми игроками"
-    elif payment_type == "creator":
-        payment_text = "организатор оплачивает корт"
-    elif payment_type == "discuss":
-        payment_text = "обсудим оплату в чате"
-    else:
-        payment_text = "не указано"
-
-    # Время матча с учётом длительности
-    duration_minutes = game["duration_minutes"]
-    if duration_minutes:
-        hours = duration_minutes // 60
-        mins = duration_minutes % 60
-        if hours and mins:
-            duration_text = f"{hours} ч {mins} мин"
-        elif hours:
-            duration_text = f"{hours} ч"
-        else:
-            duration_text = f"{mins} мин"
-    else:
-        duration_text = None
-
-    if game["match_end_time"]:
-        if duration_text:
-            time_line = f"Время: {game['match_time']}–{game['match_end_time']} ({duration_text})\n"
-        else:
-            time_line = f"Время: {game['match_time']}–{game['match_end_time']}\n"
-    else:
-        if duration_text:
-            time_line = f"Время: {game['match_time']} ({duration_text})\n"
-        else:
-            time_line = f"Время: {game['match_time']}\n"
 
     invite_text = (
         f"📩 Тебя пригласили в матч #{game_id}!\n\n"
@@ -4338,14 +4866,8 @@ async def send_invite_callback(callback: CallbackQuery):
         f"Организатор: {creator_line}\n"
         f"Тип: {game['game_type']}\n"
         f"Дата: {game['match_date']}\n"
-        f"{time_line}"
-        f"Корт: {game['court_short_name']} — <i>📍 {addr}</i>\n"
-        f"Игроки: {occupied} из {total}\n"
-        f"Ограничение по рейтингу: {rating_text}\n"
-        f"Бронь корта: {booking_text}\n"
-        f"Оплата: {payment_text}\n"
-        f"Комментарий: {comment_text}\n"
-        f"Счёт: {score_text}"
+        + format_game_card_body(game, occupied, total)
+        + f"\nСчёт: {game['score'] or '—'}"
     )
 
     # Клавиатура для приглашённого
@@ -4442,9 +4964,8 @@ async def invite_decision_callback(callback: CallbackQuery):
         # Игрок отклонил приглашение
         try:
             # Зафиксируем это в таблице заявок, чтобы в будущем можно было анализировать
-            async with aiosqlite.connect(DB_PATH) as db:
-                db.row_factory = aiosqlite.Row
-                cursor = await db.execute(
+            async with db() as conn:
+                cursor = await conn.execute(
                     "SELECT id FROM game_applications WHERE game_id = ? AND applicant_id = ?;",
                     (game_id, invited_id),
                 )
@@ -4452,16 +4973,16 @@ async def invite_decision_callback(callback: CallbackQuery):
                 await cursor.close()
 
                 if row:
-                    await db.execute(
+                    await conn.execute(
                         "UPDATE game_applications SET status = 'rejected' WHERE id = ?;",
                         (row["id"],),
                     )
                 else:
-                    await db.execute(
+                    await conn.execute(
                         "INSERT INTO game_applications (game_id, applicant_id, status) VALUES (?, ?, 'rejected');",
                         (game_id, invited_id),
                     )
-                await db.commit()
+                await conn.commit()
         except Exception as e:
             logger.exception("Failed to store rejected invitation: %s", e)
 
@@ -4511,9 +5032,8 @@ async def invite_decision_callback(callback: CallbackQuery):
 
     # Фиксируем участие игрока как принятую заявку
     try:
-        async with aiosqlite.connect(DB_PATH) as db:
-            db.row_factory = aiosqlite.Row
-            cursor = await db.execute(
+        async with db() as conn:
+            cursor = await conn.execute(
                 "SELECT id, status FROM game_applications WHERE game_id = ? AND applicant_id = ?;",
                 (game_id, invited_id),
             )
@@ -4522,17 +5042,17 @@ async def invite_decision_callback(callback: CallbackQuery):
 
             if not row:
                 # Создаём запись сразу со статусом accepted
-                await db.execute(
+                await conn.execute(
                     "INSERT INTO game_applications (game_id, applicant_id, status) VALUES (?, ?, 'accepted');",
                     (game_id, invited_id),
                 )
             else:
-                await db.execute(
+                await conn.execute(
                     "UPDATE game_applications SET status = 'accepted' WHERE id = ?;",
                     (row["id"],),
                 )
 
-            await db.commit()
+            await conn.commit()
     except Exception as e:
         logger.exception("Failed to store accepted invitation: %s", e)
         await callback.answer("Не удалось сохранить участие, попробуй позже.", show_alert=True)
@@ -4541,12 +5061,8 @@ async def invite_decision_callback(callback: CallbackQuery):
     # Обновим список участников с учётом принятого приглашения
     participant_ids = await get_game_participant_ids(game_id, include_creator=True)
 
-    # Словарь профилей участников
-    users_by_id = {}
-    for pid in participant_ids:
-        u = await get_user(pid)
-        if u:
-            users_by_id[pid] = u
+    # Словарь профилей участников — одним запросом
+    users_by_id = await get_users_bulk(participant_ids)
 
     def format_contact(u) -> str:
         if not u:
@@ -4605,22 +5121,20 @@ async def invite_decision_callback(callback: CallbackQuery):
     except Exception as e:
         logger.exception("Failed to notify invited user about accepted invitation: %s", e)
 
-    # 3) Сообщения остальным участникам матча
-    try:
-        new_player_user = users_by_id.get(invited_id)
-        new_player_contact = format_contact(new_player_user)
-
-        for pid in participant_ids:
-            if pid == invited_id or pid == creator_id:
-                continue
-            contacts_for_other = build_contacts_for(pid)
-            await bot.send_message(
+    # 3) Сообщения остальным участникам матча — всем сразу, это разные чаты
+    new_player_contact = format_contact(users_by_id.get(invited_id))
+    await send_to_chats(
+        [
+            (
                 pid,
                 f"К вашему матчу #{game_id} присоединился новый участник {new_player_contact} ✅\n\n"
-                f"Актуальный список участников (которым вы можете написать в Telegram):\n{contacts_for_other}",
+                f"Актуальный список участников (которым вы можете написать в Telegram):\n{build_contacts_for(pid)}",
             )
-    except Exception as e:
-        logger.exception("Failed to notify existing participants about new invited one: %s", e)
+            for pid in participant_ids
+            if pid != invited_id and pid != creator_id
+        ],
+        "new participant notice",
+    )
 
     await callback.answer("Участие подтверждено ✅", show_alert=False)
 
@@ -4639,9 +5153,8 @@ async def view_participants_callback(callback: CallbackQuery):
         return
 
     # Проверяем, что матч существует и что этот пользователь — организатор
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        cursor = await db.execute(
+    async with db() as conn:
+        cursor = await conn.execute(
             "SELECT creator_id FROM games WHERE id = ?;",
             (game_id,),
         )
@@ -4662,8 +5175,9 @@ async def view_participants_callback(callback: CallbackQuery):
         return
 
     # Для каждого участника показываем полноценную карточку профиля
+    users_by_id = await get_users_bulk(participant_ids)
     for pid in participant_ids:
-        user_row = await get_user(pid)
+        user_row = users_by_id.get(pid)
         if not user_row:
             continue
 
@@ -4720,9 +5234,8 @@ async def set_score_callback(callback: CallbackQuery, state: FSMContext):
         await callback.answer("Некорректный ID матча.", show_alert=False)
         return
 
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        cursor = await db.execute(
+    async with db() as conn:
+        cursor = await conn.execute(
             "SELECT creator_id, status FROM games WHERE id = ?;",
             (game_id,),
         )
@@ -4746,7 +5259,7 @@ async def set_score_callback(callback: CallbackQuery, state: FSMContext):
     await bot.send_message(
         callback.from_user.id,
         f"Введи счёт матча #{game_id} в свободной форме (например: 6-4 3-6 10-7):",
-        reply_markup=ReplyKeyboardRemove(),
+        reply_markup=remove_kb,
     )
 
 
@@ -4760,30 +5273,34 @@ async def mygames_waiting_score_handler(message: Message, state: FSMContext):
         await state.clear()
         await message.answer(
             "Не нашёл ID матча для сохранения счёта. Попробуй ещё раз из меню.",
-            reply_markup=ReplyKeyboardRemove(),
+            reply_markup=remove_kb,
         )
         return
 
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
+    async with db() as conn:
+        await conn.execute(
             "UPDATE games SET score = ?, status = 'finished' WHERE id = ? AND creator_id = ?;",
             (score_text, game_id, message.from_user.id),
         )
-        await db.commit()
+        await conn.commit()
 
     await state.clear()
     await message.answer(
         f"Счёт матча #{game_id} сохранён ✅\n\n"
         f"Счёт: {score_text}",
-        reply_markup=ReplyKeyboardRemove(),
+        reply_markup=remove_kb,
     )
 
 # -----------------------------------------
 # HTTP-сервер для Render (healthcheck)
 # -----------------------------------------
 
+# Тело ответа healthcheck: готовые байты, без кодирования строки на каждый запрос
+_OK_RESPONSE_BODY = b"OK"
+
+
 async def handle_root(request):
-    return web.Response(text="OK")
+    return web.Response(body=_OK_RESPONSE_BODY, content_type="text/plain")
 
 
 async def start_web():
@@ -4804,10 +5321,21 @@ async def start_web():
 
 async def main():
     await init_db()
-    await asyncio.gather(
-        dp.start_polling(bot),
-        start_web(),
-    )
+    # справочник кортов грузим заранее, чтобы первый же онбординг не ждал БД
+    await refresh_courts()
+    try:
+        await asyncio.gather(
+            dp.start_polling(bot),
+            start_web(),
+            write_behind_worker(),
+            db_optimize_worker(),
+        )
+    finally:
+        await pool.close()
 
 
-if __name__ == "__main__"
\ No newline at end of file
+if __name__ == "__main__":
+    if uvloop is not None:
+        uvloop.run(main())
+    else:
+        asyncio.run(main())